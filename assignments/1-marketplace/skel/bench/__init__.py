@@ -0,0 +1,9 @@
+"""
+Benchmarks for the marketplace. Run them from the skel directory, e.g.:
+
+    python3 -m bench.soak_carts
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
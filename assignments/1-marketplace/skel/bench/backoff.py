@@ -0,0 +1,36 @@
+"""
+Compares the fixed retry waits of the tests with the adaptive backoff driven by the
+marketplace's retry-after hints, on tests 07-10: wall time, CPU time, failed attempts (polls)
+and cart completion times.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from tema.backoff import AdaptiveBackoff
+from .scenario import compare_modes
+
+
+def producer_backoff(producer):
+    """
+    Returns the extra arguments of a Producer in the adaptive mode.
+    """
+    return {"backoff": AdaptiveBackoff(producer["republish_wait_time"])}
+
+
+def consumer_backoff(consumer):
+    """
+    Returns the extra arguments of a Consumer in the adaptive mode.
+    """
+    return {"backoff": AdaptiveBackoff(consumer["retry_wait_time"])}
+
+
+MODES = {
+    "fixed": {},
+    "adaptive": {"producer_options": producer_backoff, "consumer_options": consumer_backoff},
+}
+
+
+if __name__ == "__main__":
+    compare_modes(__doc__.split("\n\n", maxsplit=1)[0], MODES, ["07", "08", "09", "10"])
@@ -0,0 +1,413 @@
+"""
+Performance baseline of the marketplace. It runs a fixed set of scenarios, tests 01-10 and
+larger generated ones, each run in a fresh process, and measures the wall and CPU time, the
+marketplace operations per second, the latency percentiles of publish and add_to_cart, the
+cart completion times and the peak RSS.
+
+    python3 -m bench.baseline record --repeat 5     # writes bench/baseline.json
+    python3 -m bench.baseline compare --repeat 5    # exits with 1 on a regression
+    python3 -m bench.baseline scaling               # thread count vs throughput
+
+The baseline file keeps every sample with the format version, the git revision, the Python
+version and the platform it was recorded on, so it can be versioned next to the code. A metric
+regresses when its median gets worse by more than --min-change (relative) and by more than
+--z standard errors. The standard errors of the medians come from the spread of the samples,
+the larger of the median absolute deviation and half the range, and never go below the
+resolution of the metric, so noisy metrics need a larger change to be flagged and a few equal
+samples do not make a change look certain. Both sides need at least 2 samples per scenario.
+
+The scaling curve runs the same generated carts at every thread count, spread over the
+consumers, with the wait times of the producers and consumers divided by --speedup, so its
+throughput shows the marketplace's contention rather than the generated sleeps.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import unittest
+
+from .scenario import GENERATED, generated_test, load_scenario, run_test
+
+FORMAT_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SCENARIOS = [f"{number:02d}" for number in range(1, 11)] + list(GENERATED)
+
+# metric -> True if higher is better
+METRICS = {
+    "wall_s": False,
+    "cpu_s": False,
+    "ops_per_s": True,
+    "publish_p50_us": False,
+    "publish_p99_us": False,
+    "add_p50_us": False,
+    "add_p99_us": False,
+    "cart_p50_s": False,
+    "cart_p99_s": False,
+    "peak_rss_kb": False,
+}
+
+# the standard error of the median of n normal samples is about 1.2533 sigma / sqrt(n), and
+# sigma is about 1.4826 times the median absolute deviation
+MEDIAN_SE = 1.2533
+MAD_SIGMA = 1.4826
+# the metrics recorded as integers (microseconds, kilobytes), with a resolution of 1; the
+# resolution of the other ones is relative to their value
+INTEGER_SUFFIXES = ("_us", "_kb")
+RELATIVE_RESOLUTION = 1e-3
+MIN_SAMPLES = 2
+
+# the work of every point of the scaling curve
+SCALING_WORK = {"producers": 8, "consumers": 64, "products": 10, "carts": 4, "seed": 0}
+
+
+def measure(scenario):
+    """
+    Runs a scenario (see scenario.load_scenario); used in a fresh process for every run.
+
+    :returns a dict with the value of every metric
+    """
+    result = run_test(load_scenario(scenario))
+    probe = result["probe"]
+    return {"wall_s": result["wall"],
+            "cpu_s": result["cpu"],
+            "ops_per_s": result["operations"] / result["wall"],
+            "publish_p50_us": probe.latencies["publish"].percentile(50),
+            "publish_p99_us": probe.latencies["publish"].percentile(99),
+            "add_p50_us": probe.latencies["add_to_cart"].percentile(50),
+            "add_p99_us": probe.latencies["add_to_cart"].percentile(99),
+            "cart_p50_s": probe.cart_percentile(50),
+            "cart_p99_s": probe.cart_percentile(99),
+            # kilobytes on Linux, the peak of this process since it was spawned
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def scaling_test(threads, speedup):
+    """
+    Builds the scenario of a point of the scaling curve: the carts of SCALING_WORK spread
+    round-robin over threads // 2 consumers and its producers over threads // 2 producers,
+    merged or repeated so every product is still produced, with all the wait times divided by
+    speedup.
+    """
+    work = generated_test(**SCALING_WORK)
+    count = max(1, threads // 2)
+    carts = [cart for consumer in work["consumers"] for cart in consumer["carts"]]
+    consumers = [{"name": f"cons{index + 1}",
+                  "retry_wait_time": work["consumers"][index % len(work["consumers"])]
+                                     ["retry_wait_time"] / speedup,
+                  "carts": carts[index::count]}
+                 for index in range(count)]
+
+    producers = []
+    for index in range(count):
+        # the producers of the work that this one stands for, never empty
+        merged = work["producers"][index % len(work["producers"])::count]
+        producers.append({"name": f"prod{index + 1}",
+                          "products": [(product, quantity, wait / speedup)
+                                       for producer in merged
+                                       for product, quantity, wait in producer["products"]],
+                          "republish_wait_time": merged[0]["republish_wait_time"] / speedup})
+    # the same number of slots in total, so the producers block as often as in the work
+    queue_size = work["marketplace"]["queue_size_per_producer"] * len(work["producers"])
+    return {"marketplace": {"queue_size_per_producer": max(1, queue_size // count)},
+            "producers": producers,
+            "consumers": consumers}
+
+
+def measure_scaling(threads, speedup):
+    """
+    Runs a point of the scaling curve; used in a fresh process for every run.
+
+    :returns the marketplace operations per second
+    """
+    result = run_test(scaling_test(threads, speedup))
+    return result["operations"] / result["wall"]
+
+
+def run_scenarios(scenarios, repeat):
+    """
+    Measures every scenario repeat times, each run in a fresh process.
+
+    :returns a dict scenario -> metric -> list of samples
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for scenario in scenarios:
+        samples = {metric: [] for metric in METRICS}
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                result = pool.apply(measure, (scenario,))
+            for metric, value in result.items():
+                samples[metric].append(value)
+        print(f"{scenario:>12}  wall {statistics.median(samples['wall_s']):7.2f} s  "
+              f"{statistics.median(samples['ops_per_s']):8.1f} ops/s", file=sys.stderr)
+        results[scenario] = samples
+    return results
+
+
+def git_revision():
+    """
+    Returns the git revision of the working tree, or None outside of a repository.
+    """
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                           capture_output=True, text=True, check=False,
+                           cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return output.stdout.strip() + ("-dirty" if dirty.strip() else "")
+
+
+def make_baseline(results, repeat):
+    """
+    Returns the content of a baseline file for the given results.
+    """
+    return {"format": FORMAT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "scenarios": results}
+
+
+def load_baseline(filename):
+    """
+    Loads a baseline file, checking its format version.
+    """
+    with open(filename, encoding="utf-8") as input_file:
+        baseline = json.load(input_file)
+    if baseline.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{filename} has format {baseline.get('format')}, "
+                         f"expected {FORMAT_VERSION}; record a new baseline")
+    return baseline
+
+
+def save_baseline(filename, baseline):
+    """
+    Writes a baseline file.
+    """
+    with open(filename, "w", encoding="utf-8") as output:
+        json.dump(baseline, output, indent=1, sort_keys=True)
+        output.write("\n")
+
+
+def resolution(metric, value):
+    """
+    Returns the smallest meaningful difference of a metric around the given value.
+    """
+    if metric.endswith(INTEGER_SUFFIXES):
+        return 1.0
+    return RELATIVE_RESOLUTION * abs(value)
+
+
+def standard_error(metric, samples):
+    """
+    Returns the estimated standard error of the median of the samples. The spread is the
+    larger of the MAD estimate and half the range: with few samples the MAD is 0 as soon as
+    two of them are equal.
+    """
+    median = statistics.median(samples)
+    mad = statistics.median(abs(sample - median) for sample in samples)
+    sigma = max(MAD_SIGMA * mad, (max(samples) - min(samples)) / 2.0,
+                resolution(metric, median))
+    return MEDIAN_SE * sigma / math.sqrt(len(samples))
+
+
+def compare_metric(metric, base, new, min_change, z_threshold):
+    """
+    Compares the samples of a metric, at least MIN_SAMPLES on each side.
+
+    :returns a tuple (relative change, z score, True if it is a significant regression); the
+    change and the z score are positive when the metric got worse
+    """
+    if min(len(base), len(new)) < MIN_SAMPLES:
+        raise ValueError(f"{metric}: at least {MIN_SAMPLES} samples are needed on each side")
+    base_median = statistics.median(base)
+    new_median = statistics.median(new)
+    worse = (base_median - new_median) if METRICS[metric] else (new_median - base_median)
+    change = worse / abs(base_median) if base_median else 0.0
+    error = math.hypot(standard_error(metric, base), standard_error(metric, new))
+    z_score = worse / error if error else 0.0
+    return change, z_score, change > min_change and z_score > z_threshold
+
+
+def compare(baseline, results, min_change, z_threshold):
+    """
+    Prints the comparison of the results with the baseline.
+
+    :returns the list of (scenario, metric) that regressed
+    """
+    regressions = []
+    print(f"baseline {baseline['revision']} recorded {baseline['created']}, "
+          f"{baseline['repeat']} runs per scenario")
+    print(f"{'scenario':>12} {'metric':>15} {'baseline':>11} {'new':>11} {'change':>8} "
+          f"{'z':>7}")
+    for scenario, samples in results.items():
+        if scenario not in baseline["scenarios"]:
+            print(f"{scenario:>12} not in the baseline")
+            continue
+        for metric in METRICS:
+            base = baseline["scenarios"][scenario][metric]
+            change, z_score, regressed = compare_metric(metric, base, samples[metric],
+                                                        min_change, z_threshold)
+            if regressed:
+                regressions.append((scenario, metric))
+            print(f"{scenario:>12} {metric:>15} {statistics.median(base):>11.4g} "
+                  f"{statistics.median(samples[metric]):>11.4g} {change * 100:>7.1f}% "
+                  f"{z_score:>7.1f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def scaling(threads, repeat, speedup):
+    """
+    Prints the throughput of the same work with an increasing number of threads, half
+    producers and half consumers, as a table and an ASCII curve.
+    """
+    context = multiprocessing.get_context("spawn")
+    curve = []
+    for count in threads:
+        throughput = []
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                throughput.append(pool.apply(measure_scaling, (count, speedup)))
+        curve.append((count, statistics.median(throughput)))
+
+    best = max(ops for _, ops in curve) or 1.0
+    print(f"{'threads':>8} {'ops/s':>9}")
+    for count, ops in curve:
+        print(f"{count:>8} {ops:>9.1f} {'#' * round(50 * ops / best)}")
+    return curve
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="measure and write a new baseline")
+    record.add_argument("--output", default=DEFAULT_BASELINE)
+
+    check = commands.add_parser("compare", help="measure and compare with the baseline")
+    check.add_argument("--baseline", default=DEFAULT_BASELINE)
+    check.add_argument("--min-change", type=float, default=0.05,
+                       help="the smallest relative change reported as a regression")
+    check.add_argument("--z", type=float, default=3.0,
+                       help="the number of standard errors a regression must exceed")
+    check.add_argument("--save", help="also write the new results as a baseline file")
+
+    for command in (record, check):
+        command.add_argument("--scenarios", nargs="+", default=SCENARIOS,
+                             choices=SCENARIOS)
+        command.add_argument("--repeat", type=int, default=3,
+                             help=f"runs per scenario, at least {MIN_SAMPLES}")
+
+    curve = commands.add_parser("scaling", help="thread count vs throughput")
+    curve.add_argument("--threads", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64, 128])
+    curve.add_argument("--repeat", type=int, default=1)
+    curve.add_argument("--speedup", type=float, default=10000.0,
+                       help="divides the generated wait times")
+    curve.add_argument("--csv", help="also write the curve to a CSV file")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Runs the command; returns the exit status.
+    """
+    args = parse_args()
+    if args.command != "scaling" and args.repeat < MIN_SAMPLES:
+        print(f"--repeat must be at least {MIN_SAMPLES} to estimate the noise", file=sys.stderr)
+        return 2
+    if args.command == "scaling":
+        curve = scaling(args.threads, args.repeat, args.speedup)
+        if args.csv:
+            with open(args.csv, "w", encoding="utf-8") as output:
+                print("threads,ops_per_s", file=output)
+                for count, ops in curve:
+                    print(f"{count},{ops}", file=output)
+        return 0
+
+    if args.command == "record":
+        save_baseline(args.output, make_baseline(run_scenarios(args.scenarios, args.repeat),
+                                                 args.repeat))
+        print(f"baseline written to {args.output}")
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    results = run_scenarios(args.scenarios, args.repeat)
+    if args.save:
+        save_baseline(args.save, make_baseline(results, args.repeat))
+    regressions = compare(baseline, results, args.min_change, args.z)
+    if regressions:
+        print(f"{len(regressions)} significant regressions")
+        return 1
+    print("no significant regressions")
+    return 0
+
+
+class TestCompare(unittest.TestCase):
+    """
+    Class used for testing the regression gate.
+    """
+    def test_noise_is_not_a_regression(self):
+        """
+        Tests that a change within the spread of a few samples is not flagged, even when the
+        MAD of both sides is 0.
+        """
+        change, z_score, regressed = compare_metric("add_p50_us", [105, 81, 81],
+                                                    [105, 105, 81], 0.05, 3.0)
+        self.assertAlmostEqual(change, 24 / 81)
+        self.assertLess(z_score, 3.0)
+        self.assertFalse(regressed)
+
+    def test_zero_mad(self):
+        """
+        Tests that equal samples still have the standard error of the metric's resolution.
+        """
+        self.assertAlmostEqual(standard_error("add_p50_us", [80, 80, 80]),
+                               MEDIAN_SE / math.sqrt(3))
+        self.assertAlmostEqual(standard_error("wall_s", [2.0, 2.0, 2.0, 2.0]),
+                               MEDIAN_SE * 2.0 * RELATIVE_RESOLUTION / 2)
+        self.assertFalse(compare_metric("wall_s", [2.0, 2.0], [2.0, 2.0], 0.05, 3.0)[2])
+
+    def test_clear_regression(self):
+        """
+        Tests that a large change with little noise is flagged, in the direction that makes
+        each metric worse.
+        """
+        self.assertTrue(compare_metric("wall_s", [1.0, 1.01, 0.99], [2.0, 2.02, 1.98],
+                                       0.05, 3.0)[2])
+        self.assertFalse(compare_metric("wall_s", [2.0, 2.02, 1.98], [1.0, 1.01, 0.99],
+                                        0.05, 3.0)[2])
+        self.assertTrue(compare_metric("ops_per_s", [200.0, 202.0, 198.0],
+                                       [100.0, 101.0, 99.0], 0.05, 3.0)[2])
+
+    def test_min_samples(self):
+        """
+        Tests that a single sample is refused, its noise cannot be estimated.
+        """
+        with self.assertRaises(ValueError):
+            compare_metric("wall_s", [1.0], [1.0, 1.1], 0.05, 3.0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Compares the fixed per-producer quota with the elastic capacity pool on the generated tests
+07-10: published units per second, failed publishes, failed adds and cart completion times.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from tema.capacity import CAPACITY_ELASTIC, CAPACITY_FIXED
+from .scenario import compare_modes
+
+MODES = {mode: {"marketplace_options": {"capacity_mode": mode}}
+         for mode in (CAPACITY_FIXED, CAPACITY_ELASTIC)}
+
+
+if __name__ == "__main__":
+    compare_modes(__doc__.split("\n\n", maxsplit=1)[0], MODES, ["07", "08", "09", "10"])
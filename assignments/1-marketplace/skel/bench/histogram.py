@@ -0,0 +1,190 @@
+"""
+Latency histogram with HDR-style log-linear buckets: every power of two range is split into
+the same number of linear sub-buckets, so values are kept with a fixed number of significant
+digits whatever their magnitude.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import math
+import random
+import unittest
+from collections import Counter
+
+PERCENTILES = (50.0, 75.0, 90.0, 99.0, 99.9, 99.99)
+
+
+class Histogram:
+    """
+    Class that records integer values (e.g. latencies in microseconds).
+    """
+
+    def __init__(self, significant_digits=3):
+        """
+        Constructor
+
+        :type significant_digits: Int
+        :param significant_digits: the number of decimal digits kept for each value
+        """
+        self.sub_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.half = 1 << (self.sub_bits - 1)
+        self.counts = Counter()
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, value):
+        bucket = max(0, value.bit_length() - self.sub_bits)
+        return bucket * self.half + (value >> bucket)
+
+    def _highest_value(self, index):
+        """
+        Returns the highest value that is recorded in the given bucket.
+        """
+        if index < 2 * self.half:
+            return index
+        bucket = index // self.half - 1
+        return ((index - bucket * self.half + 1) << bucket) - 1
+
+    def record(self, value, count=1):
+        """
+        Records a value.
+        """
+        value = max(0, int(value))
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """
+        Adds all the values recorded by another histogram with the same precision.
+        """
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        """
+        Returns the mean of the recorded values.
+        """
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, percentile):
+        """
+        Returns the value below which the given percentage of the recorded values fall.
+        """
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(percentile / 100.0 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=PERCENTILES):
+        """
+        Returns a dict with the count, mean, max and the given percentiles.
+        """
+        summary = {"count": self.total, "mean": self.mean(), "max": self.max}
+        for percentile in percentiles:
+            summary[f"p{percentile:g}"] = self.percentile(percentile)
+        return summary
+
+    def distribution(self):
+        """
+        Yields (value, percentile, total count, 1 / (1 - percentile)) rows, like the
+        percentile distribution printed by HdrHistogram.
+        """
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            fraction = seen / self.total
+            inverted = 1.0 / (1.0 - fraction) if fraction < 1.0 else math.inf
+            yield min(self._highest_value(index), self.max), fraction, seen, inverted
+
+    def format_distribution(self, scale=1000.0, unit="ms"):
+        """
+        Returns the percentile distribution as text, with values divided by scale.
+        """
+        lines = [f"{'Value (' + unit + ')':>14} {'Percentile':>12} {'TotalCount':>10} "
+                 f"{'1/(1-Percentile)':>16}"]
+        for value, fraction, seen, inverted in self.distribution():
+            lines.append(f"{value / scale:14.3f} {fraction:12.6f} {seen:10d} {inverted:16.2f}")
+        lines.append(f"#[Mean = {self.mean() / scale:.3f}, Max = {self.max / scale:.3f}, "
+                     f"Total count = {self.total}]")
+        return "\n".join(lines)
+
+
+class TestHistogram(unittest.TestCase):
+    """
+    Class used for testing the histogram buckets and percentiles.
+    """
+    def setUp(self):
+        """
+        Initialize a histogram with values spread over many powers of two.
+        """
+        generator = random.Random(0)
+        self.values = [int(generator.lognormvariate(8, 3)) for _ in range(5000)]
+        self.histogram = Histogram()
+        for value in self.values:
+            self.histogram.record(value)
+
+    def test_percentiles(self):
+        """
+        Tests the percentiles against the sorted values: never lower, and higher by at most
+        the precision of 3 significant digits.
+        """
+        values = sorted(self.values)
+        for percentile in PERCENTILES + (1.0, 25.0):
+            exact = values[max(1, math.ceil(percentile / 100.0 * len(values))) - 1]
+            value = self.histogram.percentile(percentile)
+            self.assertGreaterEqual(value, exact)
+            self.assertLessEqual(value, exact * (1 + 1e-3), f"p{percentile:g}")
+
+    def test_small_values_are_exact(self):
+        """
+        Tests that the values below 2 * 10^3 get a bucket each.
+        """
+        histogram = Histogram()
+        for value in range(2048):
+            histogram.record(value)
+        self.assertEqual([value for value, _, _, _ in histogram.distribution()],
+                         list(range(2048)))
+
+    def test_edges(self):
+        """
+        Tests an empty histogram, the value 0, the 0th and the 100th percentiles.
+        """
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), 0)
+        histogram.record(0)
+        histogram.record(-5)
+        self.assertEqual(histogram.percentile(100), 0)
+        self.assertEqual(histogram.min, 0)
+
+        self.assertEqual(self.histogram.percentile(100), max(self.values))
+        self.assertEqual(self.histogram.percentile(0), min(self.values))
+
+    def test_merge(self):
+        """
+        Tests that merging two halves gives the histogram of all the values.
+        """
+        first, second = Histogram(), Histogram()
+        for index, value in enumerate(self.values):
+            (first if index % 2 else second).record(value)
+        first.merge(second)
+        self.assertEqual(first.counts, self.histogram.counts)
+        self.assertEqual((first.total, first.sum, first.min, first.max),
+                         (self.histogram.total, self.histogram.sum, self.histogram.min,
+                          self.histogram.max))
+        self.assertEqual(first.summary(), self.histogram.summary())
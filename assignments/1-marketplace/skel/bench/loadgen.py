@@ -0,0 +1,286 @@
+"""
+Open-loop load generator for the marketplace. Carts arrive as a Poisson process at a target
+rate, whether or not the previous carts are done, and every latency is measured from the time
+the operation was supposed to start, so a stalled marketplace cannot hide its queueing delay
+(coordinated omission). The carts still in progress when the drain ends are recorded in
+the cart latencies with the time they had spent so far, so the slowest carts are never left
+out of the percentiles. The products, producers and carts are generated with the same
+functions as the tests, from test-gen/test_generator.py.
+
+Example, finding the saturation point of every engine:
+
+    python3 -m bench.loadgen --rates 5 10 20 40 80 --duration 10
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import time
+from queue import Queue
+from threading import Lock, Thread
+
+from tema.capacity import CAPACITY_ELASTIC
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+from .histogram import Histogram
+from .scenario import generated_test
+
+# the marketplace configurations that can be compared; each one gets the queue size per producer
+ENGINES = {
+    "default": Marketplace,
+    "elastic": lambda queue_size: Marketplace(queue_size, capacity_mode=CAPACITY_ELASTIC),
+    "waitlists": lambda queue_size: Marketplace(queue_size, waitlists=True),
+}
+
+OPERATIONS = ("new_cart", "add_to_cart", "remove_from_cart", "place_order")
+
+
+def generate_scenario(producers, consumers, products, carts, seed):
+    """
+    Generates products, producers and carts like test_generator.py does for a non basic test
+    (see scenario.generated_test).
+
+    :returns a tuple (producers, carts): the producers' arguments, with Product objects, and a
+    list of (retry_wait_time, operations) carts
+    """
+    config = generated_test(producers, consumers, products, carts, seed)
+    producer_args = [{"products": producer["products"],
+                      "republish_wait_time": producer["republish_wait_time"]}
+                     for producer in config["producers"]]
+    cart_list = [(consumer["retry_wait_time"], cart)
+                 for consumer in config["consumers"] for cart in consumer["carts"]]
+    return producer_args, cart_list
+
+
+class LoadGenerator:  # pylint: disable=too-many-instance-attributes
+    """
+    Class that drives a marketplace with Poisson cart arrivals and records the latencies.
+    """
+
+    def __init__(self, marketplace, carts, rate, workers):
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace under test
+
+        :type carts: List
+        :param carts: (retry_wait_time, operations) carts, used round-robin
+
+        :type rate: Float
+        :param rate: the target number of cart arrivals per second
+
+        :type workers: Int
+        :param workers: the number of threads that execute the carts
+        """
+        self.marketplace = marketplace
+        self.carts = itertools.cycle(carts)
+        self.rate = rate
+        self.workers = workers
+        self.pending = Queue()
+        self.histograms = {name: Histogram() for name in OPERATIONS + ("cart",)}
+        self.histogram_mutex = Lock()
+        self.arrived = 0
+        self.completed = 0
+        # arrival number -> intended start of the carts that are queued or running
+        self.in_flight = {}
+        # set when the run ends; the late operations are not recorded
+        self.closed = False
+
+    def _record(self, name, start, end):
+        with self.histogram_mutex:
+            if not self.closed:
+                self.histograms[name].record((end - start) * 1e6)
+
+    def _run_cart(self, arrival, intended_start, retry_wait_time, operations):
+        """
+        Executes a cart. The first operation is timed from the cart's intended arrival, the
+        next ones from the end of the previous operation.
+        """
+        start = intended_start
+        cart_id = self.marketplace.new_cart()
+        end = time.perf_counter()
+        self._record("new_cart", start, end)
+
+        for operation in operations:
+            for _ in range(operation["quantity"]):
+                start = end
+                if operation["type"] == "add":
+                    while not self.marketplace.add_to_cart(cart_id, operation["product"]):
+                        time.sleep(retry_wait_time)
+                    name = "add_to_cart"
+                else:
+                    self.marketplace.remove_from_cart(cart_id, operation["product"])
+                    name = "remove_from_cart"
+                end = time.perf_counter()
+                self._record(name, start, end)
+
+        start = end
+        self.marketplace.place_order(cart_id)
+        end = time.perf_counter()
+        self._record("place_order", start, end)
+        with self.histogram_mutex:
+            if self.in_flight.pop(arrival, None) is not None:
+                self.histograms["cart"].record((end - intended_start) * 1e6)
+                self.completed += 1
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            self._run_cart(*item)
+
+    def run(self, duration, drain):
+        """
+        Generates arrivals for duration seconds, then waits at most drain seconds for the
+        carts that are still in progress. The carts that are not done by then are recorded in
+        the cart histogram with the time since their intended start, a lower bound of their
+        latency, but not in completed.
+        """
+        threads = [Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        intended_start = start
+        while True:
+            intended_start += random.expovariate(self.rate)
+            if intended_start - start > duration:
+                break
+            delay = intended_start - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            retry_wait_time, operations = next(self.carts)
+            with self.histogram_mutex:
+                self.in_flight[self.arrived] = intended_start
+            self.pending.put((self.arrived, intended_start, retry_wait_time, operations))
+            self.arrived += 1
+
+        for _ in threads:
+            self.pending.put(None)
+        deadline = time.perf_counter() + drain
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.perf_counter()))
+
+        end = time.perf_counter()
+        with self.histogram_mutex:
+            self.closed = True
+            for intended_start in self.in_flight.values():
+                self.histograms["cart"].record((end - intended_start) * 1e6)
+            self.in_flight.clear()
+        return end - start
+
+
+def run_point(args, engine, rate):
+    """
+    Measures a single (engine, rate) point; runs in its own process so the producer threads of
+    the previous points do not interfere.
+
+    :returns a dict with the offered and achieved rates and the histograms
+    """
+    producer_args, carts = generate_scenario(args.producers, args.consumers, args.products,
+                                             args.carts, args.seed)
+    marketplace = ENGINES[engine](args.queue_size)
+    marketplace.logger.setLevel(logging.WARNING)
+    for producer in producer_args:
+        products = [(product, quantity, wait / args.producer_speedup)
+                    for product, quantity, wait in producer["products"]]
+        Producer(products, marketplace, producer["republish_wait_time"] / args.producer_speedup,
+                 daemon=True).start()
+
+    generator = LoadGenerator(marketplace, carts, rate, args.workers)
+    random.seed(args.seed)
+    # the bought products are printed, they are not part of the report
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        elapsed = generator.run(args.duration, args.drain)
+
+    return {"engine": engine, "rate": rate, "arrived": generator.arrived,
+            "completed": generator.completed, "unfinished": generator.arrived - generator.completed,
+            "achieved": generator.completed / elapsed,
+            "histograms": generator.histograms}
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 10, 20, 40],
+                        help="target cart arrivals per second")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds of arrivals for each rate")
+    parser.add_argument("--drain", type=float, default=10.0,
+                        help="seconds to wait for the carts in progress at the end")
+    parser.add_argument("--workers", type=int, default=64,
+                        help="threads executing the carts")
+    parser.add_argument("--producers", type=int, default=10)
+    parser.add_argument("--consumers", type=int, default=50,
+                        help="consumers whose carts are generated")
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--carts", type=int, default=5,
+                        help="maximum carts generated per consumer")
+    parser.add_argument("--queue-size", type=int, default=40,
+                        help="queue_size_per_producer of the marketplace")
+    parser.add_argument("--producer-speedup", type=float, default=10.0,
+                        help="divides the generated producer wait times")
+    parser.add_argument("--slo", type=float, default=1000.0,
+                        help="p99 cart latency (ms) above which a rate is saturated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--distribution", action="store_true",
+                        help="print the full cart latency distribution of every point")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Sweeps the rates for every engine and prints the latency percentiles and the saturation
+    point, the first rate that cannot be sustained or that breaks the p99 objective.
+    """
+    args = parse_args()
+    context = multiprocessing.get_context("spawn")
+
+    for engine in args.engines:
+        print(f"engine {engine}")
+        print(f"{'rate':>8} {'achieved':>9} {'done':>11} {'op':>17} {'p50':>9} {'p90':>9} "
+              f"{'p99':>9} {'p99.9':>9} {'max':>9}  (ms)")
+        saturation = None
+        for rate in args.rates:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_point, (args, engine, rate))
+
+            for name, histogram in result["histograms"].items():
+                summary = histogram.summary()
+                print(f"{rate:8g} {result['achieved']:9.2f} "
+                      f"{result['completed']:>5}/{result['arrived']:<5} {name:>17} "
+                      + " ".join(f"{summary[key] / 1000:9.2f}"
+                                 for key in ("p50", "p90", "p99", "p99.9", "max")))
+            if result["unfinished"]:
+                print(f"{'':>8} {result['unfinished']} carts unfinished after the drain, "
+                      f"in the cart latencies with their time so far")
+            if args.distribution:
+                print(result["histograms"]["cart"].format_distribution())
+
+            cart_p99 = result["histograms"]["cart"].percentile(99.0) / 1000
+            if saturation is None and (result["achieved"] < 0.95 * rate
+                                       or result["completed"] < result["arrived"]
+                                       or cart_p99 > args.slo):
+                saturation = rate
+        if saturation is None:
+            print(f"engine {engine}: not saturated up to {args.rates[-1]:g} carts/s\n")
+        else:
+            print(f"engine {engine}: saturated at {saturation:g} carts/s\n")
+
+
+if __name__ == "__main__":
+    main()
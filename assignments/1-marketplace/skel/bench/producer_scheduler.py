@@ -0,0 +1,87 @@
+"""
+Compares one thread per producer with the ProducerScheduler: thread count, context switches,
+CPU time and how closely the producers keep their publishing schedule.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import logging
+import multiprocessing
+import resource
+import threading
+import time
+
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+from tema.product import Tea
+from tema.scheduler import ProducerScheduler
+
+PRODUCT = Tea("Linden", 9, "Herbal")
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--producers", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--wait", type=float, default=0.05,
+                        help="seconds between two units of a producer")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--scheduler-threads", type=int, default=2)
+    return parser.parse_args()
+
+
+def run_mode(count, wait, duration, scheduler_threads):
+    """
+    Runs count producers that never hit their limit for duration seconds, in a fresh process.
+
+    :returns a dict with the measurements
+    """
+    marketplace = Marketplace(1 << 30)
+    marketplace.logger.setLevel(logging.WARNING)
+    scheduler = ProducerScheduler(scheduler_threads) if scheduler_threads else None
+    producers = [Producer([(PRODUCT, 1, wait)], marketplace, wait, scheduler=scheduler,
+                          daemon=True) for _ in range(count)]
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    time.sleep(duration)
+    threads = threading.active_count()
+    published = len(marketplace.queue)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    return {"threads": threads,
+            "switches": (after.ru_nvcsw + after.ru_nivcsw) - (before.ru_nvcsw + before.ru_nivcsw),
+            "cpu": (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime),
+            # a producer publishes, then waits, so it is at best one unit every wait seconds
+            "schedule": published / (count * elapsed / wait)}
+
+
+def main():
+    """
+    Prints the measurements of both modes for every producer count.
+    """
+    args = parse_args()
+    context = multiprocessing.get_context("spawn")
+    print(f"{'producers':>9} {'mode':>14} {'threads':>8} {'ctx switches':>13} {'cpu (s)':>8} "
+          f"{'on schedule':>12}")
+    for count in args.producers:
+        for mode, scheduler_threads in (("thread each", 0),
+                                        (f"scheduler x{args.scheduler_threads}",
+                                         args.scheduler_threads)):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_mode, (count, args.wait, args.duration,
+                                               scheduler_threads))
+            print(f"{count:>9} {mode:>14} {result['threads']:>8} {result['switches']:>13} "
+                  f"{result['cpu']:>8.2f} {result['schedule'] * 100:>11.1f}%")
+
+
+if __name__ == "__main__":
+    main()
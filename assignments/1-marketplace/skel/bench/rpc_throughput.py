@@ -0,0 +1,112 @@
+"""
+Localhost throughput benchmark for the remote marketplace: compares one call per round trip
+with pipelined batches, over a Unix socket and over TCP.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from threading import Thread
+
+from tema.marketplace import Marketplace
+from tema.product import Tea
+from tema.rpc import MarketplaceClient, MarketplaceServer
+
+PRODUCT = Tea("Linden", 9, "Herbal")
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--ops", type=int, default=20000,
+                        help="number of calls made by each client thread")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4],
+                        help="client thread counts to measure")
+    parser.add_argument("--batch", type=int, default=256,
+                        help="calls per frame in pipelined mode")
+    return parser.parse_args()
+
+
+def serve(address, ready):
+    """
+    Runs a marketplace server; used as the target of the server process.
+    """
+    marketplace = Marketplace(1 << 30)
+    # the server should be measured, not its log file
+    marketplace.logger.setLevel(logging.WARNING)
+    server = MarketplaceServer(marketplace, address)
+    ready.put(server.address)
+    server.serve_forever()
+
+
+def client_work(client, ops, batch):
+    """
+    Publishes a product and adds it to a cart, ops / 2 times. A batch of 1 means no pipelining.
+    """
+    producer_id = client.register_producer()
+    cart_id = client.new_cart()
+    if batch == 1:
+        for _ in range(ops // 2):
+            client.publish(producer_id, PRODUCT)
+            client.add_to_cart(cart_id, PRODUCT)
+        return
+
+    with client.pipeline() as pipeline:
+        for _ in range(ops // 2):
+            pipeline.publish(producer_id, PRODUCT)
+            pipeline.add_to_cart(cart_id, PRODUCT)
+            if len(pipeline.calls) >= batch:
+                pipeline.execute()
+        pipeline.execute()
+
+
+def measure(address, threads, ops, batch):
+    """
+    Returns the number of calls per second done by the given number of client threads.
+    """
+    client = MarketplaceClient(address, pool_size=threads, batch_size=batch)
+    workers = [Thread(target=client_work, args=(client, ops, batch)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    client.close()
+    return threads * ops / elapsed
+
+
+def main():
+    """
+    Starts a server for each transport and prints the measured throughput.
+    """
+    args = parse_args()
+    socket_path = os.path.join(tempfile.mkdtemp(), "marketplace.sock")
+    transports = {"unix": socket_path, "tcp": ("127.0.0.1", 0)}
+
+    print(f"{'transport':>9} {'threads':>7} {'mode':>10} {'calls/s':>12}")
+    for name, address in transports.items():
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve, args=(address, ready), daemon=True)
+        server.start()
+        address = ready.get()
+
+        for threads in args.threads:
+            for mode, batch in (("single", 1), ("pipelined", args.batch)):
+                rate = measure(address, threads, args.ops, batch)
+                print(f"{name:>9} {threads:>7} {mode:>10} {rate:>12.0f}")
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Helpers shared by the benchmarks: loading the test files like test.py does or generating larger
+tests like test-gen/test_generator.py, running them in process and probing the marketplace
+while they run.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import contextlib
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from json import loads
+from threading import Lock
+
+from tema.consumer import Consumer
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+from tema.product import Coffee, Tea
+from .histogram import Histogram
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "test-gen"))
+import test_generator  # pylint: disable=wrong-import-position,wrong-import-order,import-error
+
+PRODUCT_CLASSES = {"Coffee": Coffee, "Tea": Tea}
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+
+
+def test_file(number):
+    """
+    Returns the path of the input file of one of the tests, e.g. tests/07.in.
+    """
+    return os.path.join(TESTS_DIR, f"{number:02d}.in")
+
+
+def load_test(filename):
+    """
+    Loads a test input file and turns the product ids into Product objects.
+
+    :returns the configuration dict, with the keys marketplace, producers and consumers
+    """
+    with open(filename, encoding="utf-8") as input_file:
+        config = loads(input_file.read())
+
+    products = {}
+    for product_id, product_def in config.pop("products").items():
+        params = {k: v for k, v in product_def.items() if k != "product_type"}
+        products[product_id] = PRODUCT_CLASSES[product_def["product_type"]](**params)
+
+    for producer in config["producers"]:
+        producer["products"] = [(products[i], quantity, wait)
+                                for i, quantity, wait in producer["products"]]
+    for consumer in config["consumers"]:
+        for cart in consumer["carts"]:
+            for operation in cart:
+                operation["product"] = products[operation["product"]]
+    return config
+
+
+# generated scenarios, larger than the tests; the seed makes them the same on every run
+GENERATED = {
+    "gen-20x20": {"producers": 20, "consumers": 20, "products": 10, "carts": 4, "seed": 20},
+    "gen-100x100": {"producers": 100, "consumers": 100, "products": 10, "carts": 2,
+                    "seed": 100},
+}
+
+def generated_test(producers, consumers, products, carts, seed, *, queue_size=1000):
+    """
+    Generates a test like test_generator.py does for a non basic test, in the format returned
+    by scenario.load_test. The default queue size is large enough for a producer to never
+    block, during a run, on the units of the products that nobody wants; its wanted products
+    would never be published again and the run would deadlock.
+    """
+    random.seed(seed)
+    # the generator prints its progress, we only want its results
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        product_defs = test_generator.generate_products(products)
+        producer_defs = test_generator.generate_producers(producers, product_defs, False)
+        for product_id in list(product_defs):
+            if not product_defs[product_id].pop("is_produced"):
+                del product_defs[product_id]
+        consumer_defs = test_generator.generate_consumers(consumers, product_defs, 1, carts,
+                                                          True, False)
+
+    objects = {}
+    for product_id, product_def in product_defs.items():
+        params = {k: v for k, v in product_def.items() if k != "product_type"}
+        objects[product_id] = PRODUCT_CLASSES[product_def["product_type"]](**params)
+
+    for producer in producer_defs:
+        producer["products"] = [(objects[i], quantity, wait)
+                                for i, quantity, wait in producer["products"]]
+    for consumer in consumer_defs:
+        consumer["carts"] = [[dict(operation, product=objects[operation["product"]])
+                              for operation in cart["ops"]] for cart in consumer["carts"]]
+    return {"marketplace": {"queue_size_per_producer": queue_size},
+            "producers": producer_defs,
+            "consumers": consumer_defs}
+
+
+def load_scenario(scenario):
+    """
+    Loads a scenario: a test number like "07", the name of one of the GENERATED scenarios or
+    a dict with the arguments of generated_test.
+    """
+    if isinstance(scenario, dict):
+        return generated_test(**scenario)
+    if scenario in GENERATED:
+        return generated_test(**GENERATED[scenario])
+    return load_test(test_file(int(scenario)))
+
+
+class Probe:
+    """
+    Class that instruments a marketplace instance: it counts the published units and the failed
+    attempts, records the latency of every publish and add_to_cart attempt, in microseconds, and
+    the time between new_cart and place_order of every cart.
+    """
+
+    def __init__(self, marketplace):
+        self.mutex = Lock()
+        self.published = 0
+        self.failed_publish = 0
+        self.failed_add = 0
+        self.latencies = {"publish": Histogram(), "add_to_cart": Histogram()}
+        self.cart_starts = {}
+        self.cart_times = []
+
+        try_publish = marketplace.try_publish
+        try_add_to_cart = marketplace.try_add_to_cart
+        new_cart = marketplace.new_cart
+        place_order = marketplace.place_order
+
+        def probed_try_publish(producer_id, product):
+            start = time.perf_counter()
+            result = try_publish(producer_id, product)
+            end = time.perf_counter()
+            with self.mutex:
+                self.latencies["publish"].record((end - start) * 1e6)
+                if result:
+                    self.published += 1
+                else:
+                    self.failed_publish += 1
+            return result
+
+        def probed_try_add_to_cart(cart_id, product):
+            start = time.perf_counter()
+            result = try_add_to_cart(cart_id, product)
+            end = time.perf_counter()
+            with self.mutex:
+                self.latencies["add_to_cart"].record((end - start) * 1e6)
+                if not result:
+                    self.failed_add += 1
+            return result
+
+        def probed_new_cart():
+            cart_id = new_cart()
+            with self.mutex:
+                self.cart_starts[cart_id] = time.perf_counter()
+            return cart_id
+
+        def probed_place_order(cart_id):
+            cart = place_order(cart_id)
+            end = time.perf_counter()
+            with self.mutex:
+                self.cart_times.append(end - self.cart_starts.pop(cart_id))
+            return cart
+
+        # the public methods call the try_ variants through the instance, so both are counted
+        marketplace.try_publish = probed_try_publish
+        marketplace.try_add_to_cart = probed_try_add_to_cart
+        marketplace.new_cart = probed_new_cart
+        marketplace.place_order = probed_place_order
+
+    def cart_percentile(self, percentile):
+        """
+        Returns the given percentile of the cart completion times, in seconds.
+        """
+        with self.mutex:
+            times = sorted(self.cart_times)
+        if not times:
+            return 0.0
+        return times[min(len(times) - 1, int(percentile / 100.0 * len(times)))]
+
+
+def run_test(config, marketplace_options=None, producer_options=None, consumer_options=None):
+    """
+    Runs a loaded test in this process, like test.py, with the bought products discarded. The
+    producers are daemon threads that keep running, so run a single test per process.
+
+    :type marketplace_options: Dict
+    :param marketplace_options: extra arguments for the Marketplace
+
+    :type producer_options: Function
+    :param producer_options: returns the extra arguments of a Producer given its configuration
+
+    :type consumer_options: Function
+    :param consumer_options: returns the extra arguments of a Consumer given its configuration
+
+    :returns a dict with the wall time, the CPU time, the number of marketplace operations
+    and the Probe
+    """
+    marketplace = Marketplace(**config["marketplace"], **(marketplace_options or {}))
+    marketplace.logger.setLevel(logging.WARNING)
+    probe = Probe(marketplace)
+
+    producers = [Producer(**producer, marketplace=marketplace, daemon=True,
+                          **(producer_options(producer) if producer_options else {}))
+                 for producer in config["producers"]]
+    consumers = [Consumer(**consumer, marketplace=marketplace,
+                          **(consumer_options(consumer) if consumer_options else {}))
+                 for consumer in config["consumers"]]
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        for producer in producers:
+            producer.start()
+        for consumer in consumers:
+            consumer.start()
+        for consumer in consumers:
+            consumer.join()
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    operations = sum(operation["quantity"] for consumer in config["consumers"]
+                     for cart in consumer["carts"] for operation in cart)
+    return {"wall": elapsed,
+            "cpu": (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime),
+            "operations": operations,
+            "probe": probe}
+
+
+def run_mode(scenario, options):
+    """
+    Runs a scenario (see load_scenario) with the given extra arguments of run_test and
+    summarizes what the Probe saw; used in a fresh process for every run.
+
+    :returns a dict with the wall and CPU time, the published units per second, the failed
+    attempts and the cart completion percentiles
+    """
+    result = run_test(load_scenario(scenario), **options)
+    probe = result.pop("probe")
+    result["published"] = probe.published / result["wall"]
+    result["failed_publish"] = probe.failed_publish
+    result["failed_add"] = probe.failed_add
+    result["cart_p50"] = probe.cart_percentile(50)
+    result["cart_p99"] = probe.cart_percentile(99)
+    result["cart_max"] = probe.cart_percentile(100)
+    return result
+
+
+def compare_modes(description, modes, scenarios):
+    """
+    The main function of the benchmarks that compare marketplace configurations: runs every
+    scenario in every mode, each run in a fresh process, and prints a row per run.
+
+    :type description: String
+    :param description: the description of the command line
+
+    :type modes: Dict
+    :param modes: mode name -> the extra arguments of run_test; they are sent to the process
+    of the run, so the functions among them must be defined at module level
+
+    :type scenarios: List
+    :param scenarios: the default scenarios, see load_scenario
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--scenarios", nargs="+", default=scenarios)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'scenario':>12} {'mode':>9} {'wall (s)':>9} {'cpu (s)':>8} {'published/s':>12} "
+          f"{'failed publish':>15} {'failed add':>11} {'cart p50':>9} {'cart p99':>9} "
+          f"{'cart max':>9}")
+    for scenario in args.scenarios:
+        for mode, options in modes.items():
+            for _ in range(args.repeat):
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_mode, (scenario, options))
+                print(f"{scenario:>12} {mode:>9} {result['wall']:>9.2f} {result['cpu']:>8.2f} "
+                      f"{result['published']:>12.1f} {result['failed_publish']:>15} "
+                      f"{result['failed_add']:>11} {result['cart_p50']:>9.2f} "
+                      f"{result['cart_p99']:>9.2f} {result['cart_max']:>9.2f}")
@@ -0,0 +1,86 @@
+"""
+Soak benchmark for the cart lifecycle: creates an endless stream of carts and checks that
+the memory used by the marketplace stays flat.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import sys
+import tracemalloc
+
+from tema.marketplace import Marketplace
+from tema.product import Coffee, Tea
+
+
+def parse_args():
+    """
+    Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--carts", type=int, default=200000,
+                        help="total number of carts to create")
+    parser.add_argument("--batch", type=int, default=20000,
+                        help="number of carts between two memory samples")
+    parser.add_argument("--history", type=int, default=1000,
+                        help="order_history_size of the marketplace")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative growth between the first and the last sample")
+    return parser.parse_args()
+
+
+def run_batch(marketplace, producer_id, products, count):
+    """
+    Creates, fills and places count carts.
+    """
+    for i in range(count):
+        cart_id = marketplace.new_cart()
+        for product in products:
+            marketplace.publish(producer_id, product)
+            marketplace.add_to_cart(cart_id, product)
+        marketplace.remove_from_cart(cart_id, products[i % len(products)])
+        marketplace.place_order(cart_id)
+
+
+def main():
+    """
+    Runs the soak benchmark and exits with a non-zero code if memory keeps growing.
+    """
+    args = parse_args()
+    products = [Coffee("Arabica", 3, 5.02, "DARK"), Tea("Linden", 9, "Herbal")]
+
+    marketplace = Marketplace(len(products) * 2, order_history_size=args.history)
+    # the log file is rotated, we only want to measure the marketplace itself
+    marketplace.logger.setLevel(logging.WARNING)
+    producer_id = marketplace.register_producer()
+
+    tracemalloc.start()
+    samples = []
+    for done in range(0, args.carts, args.batch):
+        # the orders are printed, keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_batch(marketplace, producer_id, products, args.batch)
+        current, peak = tracemalloc.get_traced_memory()
+        samples.append(current)
+        print(f"carts={done + args.batch:>9} current={current / 1024:10.1f} KiB "
+              f"peak={peak / 1024:10.1f} KiB open={len(marketplace.consumers)} "
+              f"history={len(marketplace.orders)}")
+    tracemalloc.stop()
+
+    # the first batch fills the order history, compare against the steady state
+    baseline = samples[1] if len(samples) > 2 else samples[0]
+    growth = (samples[-1] - baseline) / baseline
+    print(f"growth after warm-up: {growth * 100:.2f}%")
+    if growth > args.tolerance:
+        print("FAILED: memory is not bounded")
+        sys.exit(1)
+    print("PASSED")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""
+Compares the marketplace without and with the FIFO waitlists on tests 07-10 and the larger
+generated scenarios: failed adds, p50/p99/max cart completion times and wall time.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from .scenario import GENERATED, compare_modes
+
+MODES = {
+    "retry": {},
+    "waitlists": {"marketplace_options": {"waitlists": True}},
+}
+
+
+if __name__ == "__main__":
+    compare_modes(__doc__.split("\n\n", maxsplit=1)[0], MODES,
+                  ["07", "08", "09", "10"] + list(GENERATED))
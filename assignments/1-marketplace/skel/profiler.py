@@ -0,0 +1,174 @@
+"""
+This module profiles the Producer and Consumer threads of a test.py run, either with a cProfile
+profiler in every thread or by sampling the stacks of all the threads at a fixed interval.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class _Snapshot:
+    """
+    The stats of a profiler that may still be running in another thread; pstats would disable
+    the profiler from the wrong thread if it was given the profiler itself.
+    """
+
+    def __init__(self, profile):
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        """
+        The stats are already created.
+        """
+
+
+class ThreadProfiler:
+    """
+    Class that runs a cProfile profiler in each wrapped thread and merges their results.
+    Starting with Python 3.12 a profiler sees every thread, so a single one is used instead.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.mutex = threading.Lock()
+        self.global_profile = None
+        if sys.version_info >= (3, 12):
+            self.global_profile = cProfile.Profile()
+            self.global_profile.enable()
+
+    def wrap(self, thread):
+        """
+        Makes the thread run under its own profiler. Must be called before thread.start().
+        """
+        if self.global_profile is not None:
+            return
+        run = thread.run
+
+        def profiled_run():
+            profile = cProfile.Profile()
+            with self.mutex:
+                self.profiles.append(profile)
+            profile.runcall(run)
+
+        thread.run = profiled_run
+
+    def stats(self):
+        """
+        Returns the merged pstats.Stats of all the threads, including the ones that are still
+        running (e.g. the daemon producers).
+        """
+        if self.global_profile is not None:
+            self.global_profile.disable()
+            return pstats.Stats(self.global_profile)
+
+        with self.mutex:
+            snapshots = [_Snapshot(profile) for profile in self.profiles]
+        stats = pstats.Stats(snapshots[0])
+        for snapshot in snapshots[1:]:
+            stats.add(snapshot)
+        return stats
+
+    def report(self, output, dump_file=None, limit=30):
+        """
+        Writes the functions with the highest cumulative and internal time to output and
+        optionally dumps the merged stats in the pstats format (for snakeviz, gprof2dot...).
+        """
+        stats = self.stats()
+        stats.stream = output
+        print(f"merged profile of {len(self.profiles) or 'all'} threads", file=output)
+        stats.sort_stats("cumulative").print_stats(limit)
+        stats.sort_stats("tottime").print_stats(limit)
+        if dump_file:
+            stats.dump_stats(dump_file)
+
+
+class StackSampler(threading.Thread):
+    """
+    Class that samples the stacks of all the threads at a fixed interval. Stacks are recorded
+    root first, under the class name of their thread, so the samples of all the Consumers (or
+    Producers) are merged together.
+    """
+
+    def __init__(self, interval):
+        """
+        Constructor
+
+        :type interval: Float
+        :param interval: seconds between two samples
+        """
+        threading.Thread.__init__(self, name="StackSampler", daemon=True)
+        self.interval = interval
+        self.samples = Counter()
+        self.count = 0
+        # seconds spent taking the samples, the overhead of the sampler
+        self.busy = 0.0
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            start = time.perf_counter()
+            threads = {thread.ident: type(thread).__name__ for thread in threading.enumerate()}
+            # pylint: disable=protected-access
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                stack.append(threads.get(ident, "Thread"))
+                self.samples[";".join(reversed(stack))] += 1
+            self.count += 1
+            self.busy += time.perf_counter() - start
+
+    def stop(self):
+        """
+        Stops sampling and waits for the sampler thread.
+        """
+        self.stopped.set()
+        self.join()
+
+    def write_collapsed(self, filename):
+        """
+        Writes the samples in the collapsed stack format read by flamegraph.pl, speedscope,
+        inferno...: one "root;...;leaf count" line per distinct stack.
+        """
+        with open(filename, "w", encoding="utf-8") as output:
+            for stack, count in sorted(self.samples.items()):
+                print(f"{stack} {count}", file=output)
+
+    def report(self, output, limit=30):
+        """
+        Writes the frames that were most often on top of a stack (self time) and on a stack
+        (total time), as a percentage of all the thread samples.
+        """
+        leaves = Counter()
+        totals = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            leaves[frames[-1]] += count
+            for frame in set(frames[1:]):
+                totals[frame] += count
+        samples = sum(self.samples.values()) or 1
+
+        print(f"{self.count} samples every {self.interval * 1000:g} ms, "
+              f"{samples} thread stacks, {self.busy:.3f} s spent sampling", file=output)
+        for title, counter in (("self", leaves), ("total", totals)):
+            print(f"\n{title:>7}  frame", file=output)
+            for frame, count in counter.most_common(limit):
+                print(f"{count * 100.0 / samples:6.2f}%  {frame}", file=output)
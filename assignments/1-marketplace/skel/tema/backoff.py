@@ -0,0 +1,143 @@
+"""
+This module offers the retry helpers: the IntervalEstimator used by the Marketplace to compute
+retry-after hints and the AdaptiveBackoff policy used by producers and consumers.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import random
+import unittest
+
+
+class IntervalEstimator:
+    """
+    Class that estimates, for each key, the interval between two consecutive events with an
+    exponentially weighted moving average, and from it the time until the next event.
+    """
+
+    def __init__(self, smoothing=0.2):
+        """
+        Constructor
+
+        :type smoothing: Float
+        :param smoothing: the weight of the newest interval in the average
+        """
+        self.smoothing = smoothing
+        # key -> [time of the last event, average interval or None]
+        self.events = {}
+
+    def record(self, key, now):
+        """
+        Records an event for the given key.
+        """
+        event = self.events.get(key)
+        if event is None:
+            self.events[key] = [now, None]
+            return
+        interval = now - event[0]
+        event[1] = interval if event[1] is None else \
+            event[1] + self.smoothing * (interval - event[1])
+        event[0] = now
+
+    def time_to_next(self, key, now):
+        """
+        Returns the expected number of seconds until the next event, 0 if it is overdue, or
+        None if there is no estimate yet.
+        """
+        event = self.events.get(key)
+        if event is None or event[1] is None:
+            return None
+        return max(0.0, event[0] + event[1] - now)
+
+
+class AdaptiveBackoff:
+    """
+    Class that computes the waits between retries. When the marketplace gives a retry-after
+    hint, the wait follows the hint; otherwise it grows exponentially from the base wait. In
+    both cases consecutive failures raise a floor (so an overdue hint does not turn into fast
+    polling), the wait is capped, and it is jittered so that the callers that failed together
+    do not retry together.
+    """
+
+    def __init__(self, base, min_delay=None, cap=None, multiplier=2.0, jitter=0.5):
+        """
+        Constructor
+
+        :type base: Float
+        :param base: the first wait when there is no hint, e.g. retry_wait_time
+
+        :type min_delay: Float
+        :param min_delay: the first floor applied to hints, base / 10 by default
+
+        :type cap: Float
+        :param cap: the longest wait, 10 * base by default
+
+        :type multiplier: Float
+        :param multiplier: how much the waits grow after each consecutive failure
+
+        :type jitter: Float
+        :param jitter: the fraction of the wait that is randomized
+        """
+        self.base = base
+        self.min_delay = base / 10 if min_delay is None else min_delay
+        self.cap = 10 * base if cap is None else cap
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.failures = 0
+
+    def reset(self):
+        """
+        Called after a successful attempt.
+        """
+        self.failures = 0
+
+    def next_delay(self, retry_after=None):
+        """
+        Called after a failed attempt.
+
+        :type retry_after: Float
+        :param retry_after: the hint given by the marketplace, if any
+
+        :returns the number of seconds to wait before the next attempt
+        """
+        growth = self.multiplier ** self.failures
+        if retry_after is None:
+            delay = self.base * growth
+        else:
+            delay = max(retry_after, self.min_delay * growth)
+        self.failures += 1
+        delay = min(delay, self.cap)
+        return delay * (1.0 - self.jitter * random.random())
+
+
+class TestBackoff(unittest.TestCase):
+    """
+    Class used for testing the retry helpers.
+    """
+    def test_interval_estimator(self):
+        """
+        Tests the estimate of the time until the next event.
+        """
+        estimator = IntervalEstimator(smoothing=0.5)
+        self.assertIsNone(estimator.time_to_next("a", 0.0))
+        estimator.record("a", 1.0)
+        estimator.record("a", 2.0)
+        estimator.record("a", 5.0)
+        self.assertAlmostEqual(estimator.time_to_next("a", 6.0), 1.0)
+        self.assertEqual(estimator.time_to_next("a", 9.0), 0.0)
+
+    def test_backoff(self):
+        """
+        Tests that waits follow the hints, grow without them and stay below the cap.
+        """
+        backoff = AdaptiveBackoff(0.1, jitter=0.0)
+        self.assertAlmostEqual(backoff.next_delay(0.05), 0.05)
+        self.assertAlmostEqual(backoff.next_delay(0.0), 0.02)
+        self.assertAlmostEqual(backoff.next_delay(), 0.4)
+        for _ in range(10):
+            delay = backoff.next_delay()
+        self.assertAlmostEqual(delay, 1.0)
+        backoff.reset()
+        self.assertAlmostEqual(backoff.next_delay(), 0.1)
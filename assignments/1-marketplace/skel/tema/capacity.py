@@ -0,0 +1,212 @@
+"""
+This module offers the capacity policies of the Marketplace: how many units each producer may
+have published and not yet taken by consumers.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+
+CAPACITY_FIXED = "fixed"
+CAPACITY_ELASTIC = "elastic"
+
+
+class FixedCapacity:
+    """
+    Every producer has the same fixed number of slots, queue_size_per_producer.
+    The methods must be called with the marketplace's prod_mutex held.
+    """
+
+    def __init__(self, counts, queue_size_per_producer):
+        """
+        Constructor
+
+        :type counts: Dict
+        :param counts: producer id -> number of its units in the marketplace, shared with the
+        marketplace (Marketplace.producers)
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the number of slots of each producer
+        """
+        self.counts = counts
+        self.queue_size_per_producer = queue_size_per_producer
+
+    def register(self, producer_id):
+        """
+        Adds a producer with no units.
+        """
+        self.counts[producer_id] = 0
+
+    def try_acquire(self, producer_id, product, now):  # pylint: disable=unused-argument
+        """
+        Takes a slot for a unit the producer wants to publish.
+
+        :returns True if the unit can be published
+        """
+        if self.counts[producer_id] < self.queue_size_per_producer:
+            self.counts[producer_id] += 1
+            return True
+        return False
+
+    def release(self, producer_id):
+        """
+        Frees a slot when one of the producer's units is taken by a consumer.
+        """
+        self.counts[producer_id] -= 1
+
+    def restore(self, producer_id):
+        """
+        Takes back a slot, whatever the limits, for a unit returned to the marketplace.
+        """
+        self.counts[producer_id] += 1
+
+    def note_miss(self, product, now):
+        """
+        Called when a consumer did not find a product.
+        """
+
+
+class ElasticCapacity(FixedCapacity):
+    """
+    The producers share a global pool of slots. Each producer is guaranteed min_per_producer
+    slots and may use up to its fair share, queue_size_per_producer, while the pool has room.
+    Beyond its fair share (up to max_per_producer) it may only grow while one of the products
+    it publishes is in demand, i.e. a consumer missed it in the last demand_window seconds, so
+    the slots idle producers leave unused go to the producers consumers are waiting for.
+    """
+
+    def __init__(self, counts, queue_size_per_producer, *, pool_size=None,
+                 min_per_producer=None, max_per_producer=None, demand_window=1.0):
+        """
+        Constructor
+
+        :type pool_size: Int
+        :param pool_size: the number of slots shared by all the producers; by default
+        queue_size_per_producer for each registered producer
+
+        :type min_per_producer: Int
+        :param min_per_producer: the slots reserved for each producer, by default half of
+        queue_size_per_producer
+
+        :type max_per_producer: Int
+        :param max_per_producer: the most slots a producer may use, by default twice
+        queue_size_per_producer
+
+        :type demand_window: Float
+        :param demand_window: how many seconds a missed product counts as in demand
+        """
+        FixedCapacity.__init__(self, counts, queue_size_per_producer)
+        self.pool_size = pool_size
+        self.min_per_producer = max(1, queue_size_per_producer // 2) \
+            if min_per_producer is None else min_per_producer
+        self.max_per_producer = 2 * queue_size_per_producer \
+            if max_per_producer is None else max_per_producer
+        self.demand_window = demand_window
+        # sum of max(count, min_per_producer): the slots in use or reserved
+        self.used = 0
+        # product -> time of the last miss, producer id -> the products it published
+        self.missed = {}
+        self.products = {}
+
+    def _pool(self):
+        if self.pool_size is None:
+            return self.queue_size_per_producer * len(self.counts)
+        return self.pool_size
+
+    def _change(self, producer_id, delta):
+        before = max(self.counts[producer_id], self.min_per_producer)
+        self.counts[producer_id] += delta
+        self.used += max(self.counts[producer_id], self.min_per_producer) - before
+
+    def _in_demand(self, producer_id, now):
+        return any(now - self.missed.get(product, float("-inf")) <= self.demand_window
+                   for product in self.products[producer_id])
+
+    def register(self, producer_id):
+        FixedCapacity.register(self, producer_id)
+        self.products[producer_id] = set()
+        self.used += self.min_per_producer
+
+    def try_acquire(self, producer_id, product, now):
+        count = self.counts[producer_id]
+        self.products[producer_id].add(product)
+        if count >= self.min_per_producer:
+            if count >= self.max_per_producer or self.used >= self._pool():
+                return False
+            if count >= self.queue_size_per_producer and not self._in_demand(producer_id, now):
+                return False
+        self._change(producer_id, 1)
+        return True
+
+    def release(self, producer_id):
+        self._change(producer_id, -1)
+
+    def restore(self, producer_id):
+        self._change(producer_id, 1)
+
+    def note_miss(self, product, now):
+        self.missed[product] = now
+
+
+def make_capacity(counts, queue_size_per_producer, capacity_mode, **options):
+    """
+    Builds the capacity policy for the given mode, CAPACITY_FIXED or CAPACITY_ELASTIC.
+
+    :raises TypeError: if options are given for CAPACITY_FIXED, which has none
+    """
+    if capacity_mode == CAPACITY_FIXED:
+        if options:
+            raise TypeError(f"unexpected keyword arguments {', '.join(sorted(options))} "
+                            f"for the {CAPACITY_FIXED} capacity mode")
+        return FixedCapacity(counts, queue_size_per_producer)
+    if capacity_mode == CAPACITY_ELASTIC:
+        return ElasticCapacity(counts, queue_size_per_producer, **options)
+    raise ValueError(f"unknown capacity mode {capacity_mode}")
+
+
+class TestElasticCapacity(unittest.TestCase):
+    """
+    Class used for testing the elastic capacity policy.
+    """
+    def setUp(self):
+        """
+        Initialize a pool of 3 producers with 4 slots each.
+        """
+        self.counts = {}
+        self.capacity = ElasticCapacity(self.counts, 4, min_per_producer=2, max_per_producer=8)
+        for producer_id in ("idle", "busy", "other"):
+            self.capacity.register(producer_id)
+
+    def fill(self, producer_id, product, now=0.0):
+        """
+        Publishes until the producer is refused; returns the number of published units.
+        """
+        published = 0
+        while self.capacity.try_acquire(producer_id, product, now):
+            published += 1
+        return published
+
+    def test_fair_share_without_demand(self):
+        """
+        Tests that without demand every producer gets its fair share.
+        """
+        self.assertEqual(self.fill("busy", "tea"), 4)
+        self.assertEqual(self.capacity.used, 8)
+
+    def test_demand_borrows_from_the_pool(self):
+        """
+        Tests that a producer in demand grows past its fair share, while the reserved slots of
+        the others stay available.
+        """
+        self.fill("busy", "tea")
+        self.capacity.note_miss("tea", 0.5)
+        self.assertEqual(self.fill("busy", "tea", 1.0), 4)
+        self.assertEqual(self.counts["busy"], 8)
+        self.assertEqual(self.fill("idle", "coffee", 1.0), 2)
+        self.assertEqual(self.fill("other", "coffee", 1.0), 2)
+
+        self.capacity.release("busy")
+        self.assertFalse(self.capacity.try_acquire("busy", "tea", 5.0), "Demand is too old!")
+        self.assertEqual(self.capacity.used, 11)
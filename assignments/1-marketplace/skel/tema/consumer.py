@@ -6,15 +6,45 @@ Assignment 1
 March 2021
 """
 
+import unittest
 from threading import Thread
 from time import sleep
 
+from .marketplace import CartExpired, Marketplace
+from .product import Coffee, Tea
+
+
+def plan_cart(cart):
+    """
+    Reduces the operations of a cart to their net effect: a single add operation for each
+    product that ends up in the cart, in the order the products were first added. A remove
+    operation never takes out more units than the cart holds at that point, just like
+    Marketplace.remove_from_cart, so the planned cart buys exactly the same products.
+
+    :type cart: List
+    :param cart: a list of add and remove operations
+
+    :returns the list of add operations to perform
+    """
+    quantities = {}
+    for operation in cart:
+        product = operation["product"]
+        if operation["type"] == "add":
+            quantities[product] = quantities.get(product, 0) + operation["quantity"]
+        elif operation["type"] == "remove" and product in quantities:
+            quantities[product] = max(0, quantities[product] - operation["quantity"])
+
+    return [{"type": "add", "product": product, "quantity": quantity}
+            for product, quantity in quantities.items() if quantity > 0]
+
+
 class Consumer(Thread):
     """
     Class that represents a consumer.
     """
 
-    def __init__(self, carts, marketplace, retry_wait_time, **kwargs):
+    def __init__(self, carts, marketplace, retry_wait_time, plan_carts=False, backoff=None,
+                 **kwargs):
         """
         Constructor.
 
@@ -28,6 +58,15 @@ class Consumer(Thread):
         :param retry_wait_time: the number of seconds that a producer must wait
         until the Marketplace becomes available
 
+        :type plan_carts: Bool
+        :param plan_carts: if True, only the net effect of each cart's operations is executed
+        (see plan_cart), which takes fewer marketplace calls and never holds units that are
+        given back later
+
+        :type backoff: AdaptiveBackoff
+        :param backoff: if set, the waits after a failed add_to_cart come from this policy and
+        the marketplace's retry-after hints instead of retry_wait_time
+
         :type kwargs:
         :param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -35,17 +74,104 @@ class Consumer(Thread):
         self.carts = carts
         self.marketplace = marketplace
         self.retry_wait_time = retry_wait_time
+        self.plan_carts = plan_carts
+        self.backoff = backoff
 
-        
     def run(self):
         for cart in self.carts:
-            cart_id = self.marketplace.new_cart()
-
-            for operation in cart:
-                for _ in range(operation["quantity"]):
-                    if operation["type"] == "add":
-                        while not self.marketplace.add_to_cart(cart_id, operation["product"]):
-                            sleep(self.retry_wait_time)
-                    elif operation["type"] == "remove":
-                        self.marketplace.remove_from_cart(cart_id, operation["product"])
-            shipped_list = self.marketplace.place_order(cart_id)
+            if self.plan_carts:
+                cart = plan_cart(cart)
+            # a cart that expired while the consumer was waiting gave its products back to
+            # the marketplace, so it is bought again from the start
+            while True:
+                try:
+                    self.buy(cart)
+                    break
+                except CartExpired:
+                    continue
+
+    def buy(self, cart):
+        """
+        Executes the operations of a cart in a new marketplace cart and places the order.
+
+        :raises CartExpired: if the cart expired before the order was placed
+        """
+        cart_id = self.marketplace.new_cart()
+        for operation in cart:
+            for _ in range(operation["quantity"]):
+                if operation["type"] == "add":
+                    self.add_to_cart(cart_id, operation["product"])
+                elif operation["type"] == "remove":
+                    self.marketplace.remove_from_cart(cart_id, operation["product"])
+        return self.marketplace.place_order(cart_id)
+
+    def add_to_cart(self, cart_id, product):
+        """
+        Adds a product to the cart, waiting until it is available.
+        """
+        if self.backoff is None:
+            while not self.marketplace.add_to_cart(cart_id, product):
+                sleep(self.retry_wait_time)
+            return
+
+        result = self.marketplace.try_add_to_cart(cart_id, product)
+        while not result:
+            sleep(self.backoff.next_delay(result.retry_after))
+            result = self.marketplace.try_add_to_cart(cart_id, product)
+        self.backoff.reset()
+
+
+class TestPlanCart(unittest.TestCase):
+    """
+    Class used for testing the cart planner.
+    """
+    def setUp(self):
+        """
+        Initialize the products used in carts.
+        """
+        self.coffee = Coffee("Indonezia", 1, 5.05, "MEDIUM")
+        self.tea = Tea("Linden", 9, "Herbal")
+
+    def test_net_effect(self):
+        """
+        Tests that add and remove operations of a product are merged.
+        """
+        cart = [{"type": "add", "product": self.tea, "quantity": 1},
+                {"type": "add", "product": self.coffee, "quantity": 5},
+                {"type": "remove", "product": self.coffee, "quantity": 3}]
+        self.assertEqual(plan_cart(cart),
+                         [{"type": "add", "product": self.tea, "quantity": 1},
+                          {"type": "add", "product": self.coffee, "quantity": 2}])
+
+    def test_remove_more_than_added(self):
+        """
+        Tests that removing more units than the cart holds does not cancel later additions.
+        """
+        cart = [{"type": "remove", "product": self.tea, "quantity": 2},
+                {"type": "add", "product": self.coffee, "quantity": 2},
+                {"type": "remove", "product": self.coffee, "quantity": 3},
+                {"type": "add", "product": self.coffee, "quantity": 1}]
+        self.assertEqual(plan_cart(cart),
+                         [{"type": "add", "product": self.coffee, "quantity": 1}])
+
+
+class TestConsumer(unittest.TestCase):
+    """
+    Class used for testing the consumer.
+    """
+    def test_restart_expired_cart(self):
+        """
+        Tests that a consumer whose cart expired while it was waiting buys the cart again.
+        """
+        marketplace = Marketplace(1, cart_ttl=0.2)
+        tea = Tea("Linden", 9, "Herbal")
+        consumer = Consumer([[{"type": "add", "product": tea, "quantity": 1}]], marketplace,
+                            0.3, daemon=True)
+        consumer.start()
+        sleep(0.5)
+        self.assertTrue(consumer.is_alive(), "The consumer died with its expired cart!")
+
+        marketplace.publish(marketplace.register_producer(), tea)
+        consumer.join(2.0)
+        self.assertFalse(consumer.is_alive(), "The consumer did not buy the cart again!")
+        self.assertEqual(len(marketplace.queue), 0)
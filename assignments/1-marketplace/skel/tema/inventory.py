@@ -0,0 +1,282 @@
+"""
+This module represents the Inventory, the products available in the Marketplace, and the
+queries that search it by the attributes of the products.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from .product import Coffee, Tea
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class ProductQuery:  # pylint: disable=too-many-instance-attributes
+    """
+    Class that represents a search for any product with the given attributes. The unset
+    attributes match every product, the ranges are inclusive.
+    """
+    product_type: Optional[str] = None
+    type: Optional[str] = None
+    roast_level: Optional[str] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    min_acidity: Optional[float] = None
+    max_acidity: Optional[float] = None
+
+    def matches(self, product):
+        """
+        Returns True if the product has the attributes of the query.
+        """
+        if self.product_type is not None and type(product).__name__ != self.product_type:
+            return False
+        if self.type is not None and getattr(product, "type", None) != self.type:
+            return False
+        if self.roast_level is not None \
+                and getattr(product, "roast_level", None) != self.roast_level:
+            return False
+        if not _in_range(product.price, self.min_price, self.max_price):
+            return False
+        if self.min_acidity is not None or self.max_acidity is not None:
+            return isinstance(product, Coffee) \
+                and _in_range(product.acidity, self.min_acidity, self.max_acidity)
+        return True
+
+
+def _in_range(value, low, high):
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+class _RangeIndex:
+    """
+    Index of the products by a numeric attribute: the values of all the products, sorted, so
+    the products in a range are counted with two binary searches, and the products that have
+    each value.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.products = {}
+
+    def add(self, value, product):
+        """
+        Adds a product under the given value.
+        """
+        insort(self.values, value)
+        self.products.setdefault(value, set()).add(product)
+
+    def discard(self, value, product):
+        """
+        Removes a product from under the given value.
+        """
+        del self.values[bisect_left(self.values, value)]
+        _discard(self.products, value, product)
+
+    def _bounds(self, low, high):
+        start = 0 if low is None else bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect_right(self.values, high)
+        return start, end
+
+    def count(self, low, high):
+        """
+        Returns the number of products with the value in [low, high]; None means unbounded.
+        """
+        start, end = self._bounds(low, high)
+        return max(0, end - start)
+
+    def between(self, low, high):
+        """
+        Returns the products with the value in [low, high]; None means unbounded.
+        """
+        start, end = self._bounds(low, high)
+        products = []
+        previous = None
+        for index in range(start, end):
+            # the values of the products are sorted, so the equal ones are consecutive
+            if index == start or self.values[index] != previous:
+                previous = self.values[index]
+                products.extend(self.products[previous])
+        return products
+
+
+class Inventory:
+    """
+    Class that holds the units published in the Marketplace: for every product, the ids of
+    the producers of its units, in publishing order. The distinct available products are
+    indexed by product type, Tea.type, Coffee.roast_level, Coffee.acidity and price, so a
+    query only visits the products it may match instead of every unit.
+    It is not synchronized; the Marketplace uses it with prod_mutex held.
+    """
+
+    def __init__(self):
+        self.units = {}
+        self.size = 0
+        # attribute value -> the available products that have it
+        self.by_product_type = {}
+        self.by_type = {}
+        self.by_roast_level = {}
+        self.by_price = _RangeIndex()
+        self.by_acidity = _RangeIndex()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        """
+        Yields the (product, producer_id) entries of all the units.
+        """
+        for product, producers in self.units.items():
+            for producer_id in producers:
+                yield product, producer_id
+
+    def __contains__(self, product):
+        return product in self.units
+
+    def append(self, entry):
+        """
+        Adds a (product, producer_id) unit.
+        """
+        product, producer_id = entry
+        producers = self.units.get(product)
+        if producers is None:
+            producers = self.units[product] = deque()
+            self._index(product)
+        producers.append(producer_id)
+        self.size += 1
+
+    def take(self, product):
+        """
+        Removes the oldest unit of the product.
+
+        :returns the (product, producer_id) entry, or None if the product is not available
+        """
+        producers = self.units.get(product)
+        if producers is None:
+            return None
+        producer_id = producers.popleft()
+        if not producers:
+            del self.units[product]
+            self._unindex(product)
+        self.size -= 1
+        return product, producer_id
+
+    def find(self, query):
+        """
+        Returns the available products that match the query. The candidates come from the
+        most selective of the indexes on the attributes the query sets: the one with the
+        fewest products, which the equality indexes know right away and the range indexes
+        count with two binary searches.
+        """
+        # (number of candidates, function that returns them)
+        choices = []
+        for value, index in ((query.product_type, self.by_product_type),
+                             (query.type, self.by_type),
+                             (query.roast_level, self.by_roast_level)):
+            if value is not None:
+                products = index.get(value, ())
+                choices.append((len(products), lambda products=products: products))
+        for low, high, index in ((query.min_price, query.max_price, self.by_price),
+                                 (query.min_acidity, query.max_acidity, self.by_acidity)):
+            if low is not None or high is not None:
+                choices.append((index.count(low, high),
+                                lambda low=low, high=high, index=index: index.between(low, high)))
+
+        if choices:
+            candidates = min(choices, key=lambda choice: choice[0])[1]()
+        else:
+            candidates = self.units
+        return [product for product in candidates if query.matches(product)]
+
+    def _index(self, product):
+        self.by_product_type.setdefault(type(product).__name__, set()).add(product)
+        if isinstance(product, Tea):
+            self.by_type.setdefault(product.type, set()).add(product)
+        if isinstance(product, Coffee):
+            self.by_roast_level.setdefault(product.roast_level, set()).add(product)
+            self.by_acidity.add(product.acidity, product)
+        self.by_price.add(product.price, product)
+
+    def _unindex(self, product):
+        _discard(self.by_product_type, type(product).__name__, product)
+        if isinstance(product, Tea):
+            _discard(self.by_type, product.type, product)
+        if isinstance(product, Coffee):
+            _discard(self.by_roast_level, product.roast_level, product)
+            self.by_acidity.discard(product.acidity, product)
+        self.by_price.discard(product.price, product)
+
+
+def _discard(index, value, product):
+    products = index[value]
+    products.discard(product)
+    if not products:
+        del index[value]
+
+
+class TestInventory(unittest.TestCase):
+    """
+    Class used for testing the inventory and its indexes.
+    """
+    def setUp(self):
+        """
+        Initialize an inventory with a few units.
+        """
+        self.products = [Coffee("Indonezia", 1, 5.05, "MEDIUM"),
+                         Tea("White Peach", 5, "White"),
+                         Coffee("Brasil", 7, 5.09, "DARK"),
+                         Tea("Green Sencha", 3, "Green"),
+                         Tea("Matcha", 8, "Green")]
+        self.inventory = Inventory()
+        for product in self.products:
+            self.inventory.append((product, "producer"))
+        self.inventory.append((self.products[3], "other"))
+
+    def test_take(self):
+        """
+        Tests that the units of a product are taken in publishing order and the indexes follow.
+        """
+        self.assertEqual(len(self.inventory), 6)
+        self.assertEqual(self.inventory.take(self.products[3]), (self.products[3], "producer"))
+        self.assertEqual(self.inventory.take(self.products[3]), (self.products[3], "other"))
+        self.assertIsNone(self.inventory.take(self.products[3]))
+        self.assertEqual(self.inventory.find(ProductQuery(type="Green")), [self.products[4]])
+        self.assertEqual(len(self.inventory), 4)
+
+    def test_find(self):
+        """
+        Tests the queries on every index.
+        """
+        self.assertEqual(self.inventory.find(ProductQuery(type="Green", max_price=5)),
+                         [self.products[3]])
+        self.assertEqual(self.inventory.find(ProductQuery(roast_level="DARK")),
+                         [self.products[2]])
+        self.assertEqual(sorted(p.name for p in self.inventory.find(
+            ProductQuery(min_price=3, max_price=7))), ["Brasil", "Green Sencha", "White Peach"])
+        self.assertEqual(self.inventory.find(ProductQuery(max_acidity=5.06)), [self.products[0]])
+        self.assertEqual(len(self.inventory.find(ProductQuery(product_type="Tea"))), 3)
+        self.assertEqual(self.inventory.find(ProductQuery(type="Black")), [])
+
+    def test_most_selective_index(self):
+        """
+        Tests that a query walks the smallest index it sets, here the price range rather than
+        all the Green teas.
+        """
+        for price in range(20, 30):
+            self.inventory.append((Tea(f"Green {price}", price, "Green"), "producer"))
+        self.assertEqual(self.inventory.by_price.count(None, 4), 2)
+        self.assertEqual(self.inventory.by_price.count(40, None), 0)
+
+        visited = []
+        between = self.inventory.by_price.between
+        self.inventory.by_price.between = lambda low, high: visited.append(1) or between(low, high)
+        self.assertEqual(self.inventory.find(ProductQuery(type="Green", max_price=4)),
+                         [self.products[3]])
+        self.assertEqual(visited, [1], "The price index should be used!")
+        self.assertEqual(self.inventory.find(ProductQuery(type="Green", min_price=3)),
+                         [p for p in self.inventory.by_type["Green"] if p.price >= 3])
@@ -10,29 +10,138 @@ import uuid
 import hashlib
 import unittest
 import logging
+from collections import Counter, OrderedDict, deque
 from logging.handlers import RotatingFileHandler
 
 from threading import Lock, currentThread
+from .backoff import IntervalEstimator
+from .capacity import CAPACITY_FIXED, make_capacity
+from .inventory import Inventory, ProductQuery
 from .product import Coffee, Tea
+from .timer_wheel import TimerWheel
 
-class Marketplace:
+# The states a cart goes through. An open cart accepts add/remove operations, a placed cart
+# is kept (compacted) in the order history and an archived cart has been released entirely.
+CART_OPEN = "open"
+CART_PLACED = "placed"
+CART_ARCHIVED = "archived"
+
+# the number of cart ids; the order history may keep at most half of them, so a new cart id is
+# found after two draws on average
+CART_ID_SPACE = 1000000
+MAX_ORDER_HISTORY_SIZE = CART_ID_SPACE // 2
+
+
+class OpResult:
+    """
+    The result of try_publish and try_add_to_cart. It is truthy when the operation succeeded;
+    otherwise retry_after estimates the number of seconds until a retry can succeed (None when
+    there is no estimate yet).
+    """
+
+    __slots__ = ("ok", "retry_after")
+
+    def __init__(self, ok, retry_after=None):
+        self.ok = ok
+        self.retry_after = retry_after
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f"OpResult(ok={self.ok}, retry_after={self.retry_after})"
+
+    def __reduce__(self):
+        return (OpResult, (self.ok, self.retry_after))
+
+
+class CartExpired(Exception):
+    """
+    Raised by the cart operations when the cart is no longer open: it expired (see cart_ttl),
+    it was already placed or it never existed. The consumer should start a new cart. Its
+    state is the cart_state of the id, so CART_ARCHIVED for an id that never existed.
+    """
+
+    def __init__(self, cart_id, state):
+        Exception.__init__(self, f"cart_id:[{cart_id}] is {state}")
+        self.cart_id = cart_id
+        self.state = state
+
+    def __reduce__(self):
+        return (CartExpired, (self.cart_id, self.state))
+
+
+class Marketplace:  # pylint: disable=too-many-instance-attributes
     """
     Class that represents the Marketplace. It's the central part of the implementation.
     The producers and consumers use its methods concurrently.
     """
 
-    def __init__(self, queue_size_per_producer):
+    def __init__(self, queue_size_per_producer, order_history_size=0, cart_ttl=None,
+                 ttl_tick=0.1, capacity_mode=CAPACITY_FIXED, *, waitlists=False,
+                 **capacity_options):
         """
         Constructor
 
         :type queue_size_per_producer: Int
         :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        :type order_history_size: Int
+        :param order_history_size: how many placed orders are retained in the order history,
+        at most MAX_ORDER_HISTORY_SIZE; older orders are archived and their storage released
+
+        :type cart_ttl: Float
+        :param cart_ttl: if set, the number of seconds after which a cart with no activity
+        expires and its products are returned to the marketplace
+
+        :type ttl_tick: Float
+        :param ttl_tick: the resolution, in seconds, of the cart expiry timers
+
+        :type capacity_mode: String
+        :param capacity_mode: CAPACITY_FIXED, every producer has queue_size_per_producer slots,
+        or CAPACITY_ELASTIC, the producers share a pool of slots (see capacity.ElasticCapacity)
+
+        :type waitlists: Boolean
+        :param waitlists: if set, the carts that miss a product wait for it in a FIFO waitlist
+        and the next unit published (or returned) is handed directly to the oldest one
+
+        :type capacity_options:
+        :param capacity_options: the pool_size, min_per_producer, max_per_producer and
+        demand_window of the elastic mode
+
+        :raises TypeError: for an unknown keyword argument, also in the fixed mode
+
+        :raises ValueError: if order_history_size is negative or above MAX_ORDER_HISTORY_SIZE
         """
+        if not 0 <= order_history_size <= MAX_ORDER_HISTORY_SIZE:
+            raise ValueError(f"order_history_size must be in [0, {MAX_ORDER_HISTORY_SIZE}], "
+                             f"got {order_history_size}")
 
         self.queue_size_per_producer = queue_size_per_producer
-        self.queue = []
+        # the published (product, producer_id) units, always used with prod_mutex held
+        self.queue = Inventory()
+        # only the open carts, placed carts are moved to the order history
         self.consumers = {}
         self.producers = {}
+        # updates self.producers, always with prod_mutex held
+        self.capacity = make_capacity(self.producers, queue_size_per_producer, capacity_mode,
+                                      **capacity_options)
+        self.order_history_size = order_history_size
+        self.orders = OrderedDict()
+        self.cart_ttl = cart_ttl
+        self.cart_timers = None
+        if cart_ttl is not None:
+            self.cart_timers = TimerWheel.for_timeout(cart_ttl, ttl_tick, time.monotonic())
+        # used for the retry-after hints: how often each product is published and how often
+        # each producer's units are taken, which frees one of its slots
+        self.publish_intervals = IntervalEstimator()
+        self.take_intervals = IntervalEstimator()
+        # product -> deque of the waiting cart ids, oldest first; cart id -> Counter of the
+        # products it waits for and of the units handed to it that add_to_cart did not return
+        # yet. Only used with waitlists, always with cart_mutex held.
+        self.waitlists = {} if waitlists else None
+        self.waiting = {}
+        self.handoffs = {}
 
         self.prod_mutex = Lock()
         self.cart_mutex = Lock()
@@ -54,7 +163,8 @@ class Marketplace:
         """
         self.logger.info("Registering a new producer...")
         producer_id = str(uuid.uuid4())
-        self.producers[producer_id] = 0
+        with self.prod_mutex:
+            self.capacity.register(producer_id)
         self.logger.info("Registered a new producer with id:[%s]", producer_id)
         return producer_id
 
@@ -70,17 +180,86 @@ class Marketplace:
 
         :returns True or False. If the caller receives False, it should waitand then try again.
         """
-        if self.producers[producer_id] < self.queue_size_per_producer:
-            self.queue.append((product, producer_id))
-            self.producers[producer_id] += 1
+        return self.try_publish(producer_id, product).ok
+
+    def try_publish(self, producer_id, product):
+        """
+        Same as publish, with a retry-after hint when the product is not published: the
+        expected time until a consumer takes one of the producer's units.
+
+        :returns an OpResult
+        """
+        self.expire_carts()
+        if self.waitlists is None:
+            published = self._publish(producer_id, product)
+        else:
+            # a cart may only start waiting while the product is not in the queue
+            with self.cart_mutex:
+                if self._hand_off((product, producer_id)):
+                    with self.prod_mutex:
+                        self.publish_intervals.record(product, time.monotonic())
+                    return OpResult(True)
+                published = self._publish(producer_id, product)
+        if published:
             self.logger.info(
                 "Published product from producer_id:[%s]", producer_id)
-            return True
+            return OpResult(True)
 
         self.logger.info(
             "Product for producer_id:[%s] not published. Limit reached.", producer_id)
+        with self.prod_mutex:
+            return OpResult(False, self.take_intervals.time_to_next(producer_id, time.monotonic()))
+
+    def _publish(self, producer_id, product):
+        """
+        Adds the product to the queue if the producer has a free slot.
+
+        :returns True if the product was published
+        """
+        with self.prod_mutex:
+            now = time.monotonic()
+            published = self.capacity.try_acquire(producer_id, product, now)
+            if published:
+                self.queue.append((product, producer_id))
+                self.publish_intervals.record(product, now)
+        return published
+
+    def _hand_off(self, entry):
+        """
+        Puts a (product, producer_id) unit directly in the cart of the oldest waiter for the
+        product, bypassing the queue. The unit counts as taken from its producer. Must be
+        called with cart_mutex held.
+
+        :returns True if the unit was handed off
+        """
+        product, producer_id = entry
+        waiters = self.waitlists.get(product)
+        while waiters:
+            cart_id = waiters.popleft()
+            # skip the carts that were closed or expired while waiting
+            waiting = self.waiting.get(cart_id)
+            if waiting is None or waiting[product] == 0:
+                continue
+            waiting[product] -= 1
+            self.consumers[cart_id].append(entry)
+            self.handoffs.setdefault(cart_id, Counter())[product] += 1
+            if not waiters:
+                del self.waitlists[product]
+            with self.prod_mutex:
+                self.take_intervals.record(producer_id, time.monotonic())
+            self.logger.info("%s handed off to cart_id:[%d]", product.name, cart_id)
+            return True
+        self.waitlists.pop(product, None)
         return False
 
+    def _forget_cart(self, cart_id):
+        """
+        Drops the waitlist state of a closed cart; its stale waitlist entries are skipped.
+        Must be called with cart_mutex held.
+        """
+        self.waiting.pop(cart_id, None)
+        self.handoffs.pop(cart_id, None)
+
     def new_cart(self):
         """
         Creates a new cart for the consumer
@@ -88,6 +267,22 @@ class Marketplace:
         :returns an int representing the cart_id
         """
         self.logger.info("Generating a new cart_id.")
+        self.expire_carts()
+        with self.cart_mutex:
+            cart_id = self._generate_cart_id()
+            # ids of archived carts may be reused, ids of open or placed carts may not
+            while cart_id in self.consumers or cart_id in self.orders:
+                cart_id = self._generate_cart_id()
+            self.consumers[cart_id] = []
+            self._touch_cart(cart_id)
+        self.logger.info("New cart_id:[%d] generated", cart_id)
+        return cart_id
+
+    @staticmethod
+    def _generate_cart_id():
+        """
+        Generates a random cart id in the range [0, 999,999].
+        """
         random_cart_id = str(uuid.uuid4())
         # hash the uuid string
         hashed_cart_id = hashlib.sha256(random_cart_id.encode())
@@ -96,10 +291,76 @@ class Marketplace:
         # convert it to an int
         cart_id = int(cut_down_hex, 16)
         # limit it to 999,999
-        cart_id = cart_id % 1000000
-        self.consumers[cart_id] = []
-        self.logger.info("New cart_id:[%d] generated", cart_id)
-        return cart_id
+        return cart_id % CART_ID_SPACE
+
+    def cart_state(self, cart_id):
+        """
+        Returns the state of the given cart: CART_OPEN, CART_PLACED or CART_ARCHIVED. The
+        archived carts are not remembered, so an id that new_cart never returned is reported
+        as CART_ARCHIVED too.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+        """
+        if cart_id in self.consumers:
+            return CART_OPEN
+        if cart_id in self.orders:
+            return CART_PLACED
+        return CART_ARCHIVED
+
+    def order_history(self, cart_id):
+        """
+        Returns the products bought with a placed cart, or None if the cart is not in the
+        order history (it is still open or it has been archived).
+
+        :type cart_id: Int
+        :param cart_id: id cart
+        """
+        return self.orders.get(cart_id)
+
+    def _open_cart(self, cart_id):
+        """
+        Returns the list of an open cart. Must be called with cart_mutex held.
+
+        :raises CartExpired: if the cart is not open
+        """
+        cart = self.consumers.get(cart_id)
+        if cart is None:
+            raise CartExpired(cart_id, self.cart_state(cart_id))
+        return cart
+
+    def _touch_cart(self, cart_id):
+        """
+        Restarts the expiry timer of an open cart. Must be called with cart_mutex held.
+        """
+        if self.cart_timers is not None:
+            self.cart_timers.schedule(cart_id, self.cart_ttl)
+
+    def expire_carts(self, now=None):
+        """
+        Expires the carts that had no activity for cart_ttl seconds. Their products are put back
+        in the marketplace and the producers' counters are updated, like remove_from_cart does.
+        The operations are called lazily by every publish, new_cart, add_to_cart and
+        remove_from_cart, before they restart the timer of a cart.
+
+        :type now: Float
+        :param now: the current time.monotonic() value, defaults to the actual current time
+
+        :returns a list with the ids of the expired carts
+        """
+        if self.cart_timers is None:
+            return []
+
+        with self.cart_mutex:
+            expired = self.cart_timers.advance(time.monotonic() if now is None else now)
+            for cart_id in expired:
+                self._forget_cart(cart_id)
+                for entry in self.consumers.pop(cart_id):
+                    self._return_to_marketplace(entry)
+
+        for cart_id in expired:
+            self.logger.info("cart_id:[%d] expired", cart_id)
+        return expired
 
     def add_to_cart(self, cart_id, product):
         """
@@ -112,20 +373,106 @@ class Marketplace:
         :param product: the product to add to cart
 
         :returns True or False. If the caller receives False, it should wait and then try again
+
+        :raises CartExpired: if the cart is no longer open
+        """
+        return self.try_add_to_cart(cart_id, product).ok
+
+    def try_add_to_cart(self, cart_id, product):
         """
+        Same as add_to_cart, with a retry-after hint when the product is not available: the
+        expected time until the product is published again.
+
+        :returns an OpResult
+        """
+        self.expire_carts()
         with self.cart_mutex:
-            first_product = next(
-                (x for x in self.queue if x[0] == product), None)
+            cart = self._open_cart(cart_id)
+            self._touch_cart(cart_id)
+            if self.waitlists is not None and self._claim(cart_id, product):
+                self.logger.info("%s added to cart_id:[%d]", product.name, cart_id)
+                return OpResult(True)
+            first_product = self._take(product)
             if isinstance(first_product, tuple):
-                self.consumers[cart_id].append(first_product)
-                self.queue.remove(first_product)
-                self.producers[first_product[1]] -= 1
+                cart.append(first_product)
                 self.logger.info("%s added to cart_id:[%d]", product.name, cart_id)
-                return True
+                return OpResult(True)
+            if self.waitlists is not None:
+                self._wait(cart_id, product)
 
         self.logger.info(
             "%s not found for cart_id:[%d]", product.name, cart_id)
-        return False
+        with self.prod_mutex:
+            now = time.monotonic()
+            self.capacity.note_miss(product, now)
+            return OpResult(False, self.publish_intervals.time_to_next(product, now))
+
+    def add_matching_to_cart(self, cart_id, query):
+        """
+        Adds to the given cart the cheapest available product that matches the query, e.g.
+        ProductQuery(type="Green", max_price=5) for any Green Tea under price 5. The lookup
+        uses the attribute indexes of the inventory instead of scanning every unit.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type query: ProductQuery
+        :param query: the attributes of the wanted product
+
+        :returns the product added to cart, or None if no product matches; the caller should
+        wait and then try again
+        """
+        self.expire_carts()
+        with self.cart_mutex:
+            cart = self._open_cart(cart_id)
+            self._touch_cart(cart_id)
+            with self.prod_mutex:
+                matches = self.queue.find(query)
+            if matches:
+                first_product = self._take(min(matches, key=lambda product: product.price))
+                cart.append(first_product)
+                self.logger.info("%s added to cart_id:[%d]", first_product[0].name, cart_id)
+                return first_product[0]
+
+        self.logger.info("No product matching %s for cart_id:[%d]", query, cart_id)
+        return None
+
+    def _claim(self, cart_id, product):
+        """
+        Claims a unit of the product that was handed to the cart while it was waiting. Must be
+        called with cart_mutex held.
+
+        :returns True if there was such a unit, already in the cart
+        """
+        handoffs = self.handoffs.get(cart_id)
+        if handoffs is None or handoffs[product] == 0:
+            return False
+        handoffs[product] -= 1
+        return True
+
+    def _wait(self, cart_id, product):
+        """
+        Puts the cart at the end of the product's waitlist, unless it is already waiting for
+        a unit of it. Must be called with cart_mutex held.
+        """
+        waiting = self.waiting.setdefault(cart_id, Counter())
+        if waiting[product] == 0:
+            waiting[product] += 1
+            self.waitlists.setdefault(product, deque()).append(cart_id)
+
+    def _take(self, product):
+        """
+        Takes the oldest unit of the product out of the marketplace. Must be called with
+        cart_mutex held.
+
+        :returns the (product, producer_id) entry, or None if the product is not available
+        """
+        with self.prod_mutex:
+            entry = self.queue.take(product)
+            if entry is not None:
+                self.capacity.release(entry[1])
+                self.take_intervals.record(entry[1], time.monotonic())
+        return entry
 
     def remove_from_cart(self, cart_id, product):
         """
@@ -136,35 +483,77 @@ class Marketplace:
 
         :type product: Product
         :param product: the product to remove from cart
-        """
 
-        first_product = next(
-            (x for x in self.consumers[cart_id] if x[0] == product), None)
-        if isinstance(first_product, tuple):
-            self.queue.append(first_product)
-            self.consumers[cart_id].remove(first_product)
-            with self.cart_mutex:
-                self.producers[first_product[1]] += 1
-            self.logger.info(
-                "%s removed from cart_id:[%d]", product.name, cart_id)
-            return
+        :raises CartExpired: if the cart is no longer open
+        """
+        # the expiry timers are scheduled from the current position of the wheel
+        self.expire_carts()
+        with self.cart_mutex:
+            cart = self._open_cart(cart_id)
+            self._touch_cart(cart_id)
+            first_product = next(
+                (x for x in cart if x[0] == product), None)
+            if isinstance(first_product, tuple):
+                cart.remove(first_product)
+                self._return_to_marketplace(first_product)
+                self.logger.info(
+                    "%s removed from cart_id:[%d]", product.name, cart_id)
+                return
         self.logger.info(
             "%s not removed from cart_id:[%d], not found.", product.name, cart_id)
 
+    def _return_to_marketplace(self, entry):
+        """
+        Hands a (product, producer_id) unit that left a cart to a waiting cart or puts it back
+        in the queue. Must be called with cart_mutex held.
+        """
+        if self.waitlists is not None and self._hand_off(entry):
+            return
+        with self.prod_mutex:
+            self.queue.append(entry)
+            self.capacity.restore(entry[1])
+
     def place_order(self, cart_id):
         """
-        Return a list with all the products in the cart.
+        Return a list with all the products in the cart. The cart is closed: its storage is
+        released and its products are compacted into the order history, if it is retained.
 
         :type cart_id: Int
         :param cart_id: id cart
         """
+        cart = self.checkout(cart_id)
+
         self.logger.info("Printing cart_id:[%d]...", cart_id)
-        for product in self.consumers[cart_id]:
+        for product in cart:
             with self.print_mutex:
                 print(
                     f"{currentThread().getName()} bought {product[0]}")
         self.logger.info("Printing cart_id:[%d] done", cart_id)
-        return self.consumers[cart_id]
+        return cart
+
+    def checkout(self, cart_id):
+        """
+        Closes the cart like place_order, without printing the bought products.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :returns a list with all the products in the cart
+
+        :raises CartExpired: if the cart is no longer open
+        """
+        with self.cart_mutex:
+            self._open_cart(cart_id)
+            cart = self.consumers.pop(cart_id)
+            self._forget_cart(cart_id)
+            if self.cart_timers is not None:
+                self.cart_timers.cancel(cart_id)
+            if self.order_history_size > 0:
+                self.orders[cart_id] = tuple(product for product, _ in cart)
+                # archive the oldest orders that are no longer retained
+                while len(self.orders) > self.order_history_size:
+                    self.orders.popitem(last=False)
+        return cart
 
 
 class TestMarketplace(unittest.TestCase):
@@ -284,3 +673,200 @@ class TestMarketplace(unittest.TestCase):
         for product in range(5):
             self.assertEqual(ret[product][0], self.products[product],
                              "Not the expected products!")
+
+    def test_place_order_releases_cart(self):
+        """
+        Tests that a placed cart no longer holds storage and that the returned list is not
+        shared with the marketplace.
+        """
+        producer_ids = self.test_register_producer()
+        cart_id = self.marketplace.new_cart()
+        self.assertEqual(self.marketplace.cart_state(cart_id), CART_OPEN)
+
+        self.marketplace.publish(producer_ids[0], self.products[0])
+        self.marketplace.add_to_cart(cart_id, self.products[0])
+        ret = self.marketplace.place_order(cart_id)
+        ret.clear()
+
+        self.assertNotIn(cart_id, self.marketplace.consumers, "Cart storage NOT released!")
+        self.assertEqual(self.marketplace.cart_state(cart_id), CART_ARCHIVED)
+
+    def test_order_history_retention(self):
+        """
+        Tests that only the most recent placed orders are kept in the order history.
+        """
+        self.marketplace = Marketplace(self.limit, order_history_size=2)
+        producer_id = self.marketplace.register_producer()
+        cart_ids = []
+        for product in self.products[:3]:
+            cart_id = self.marketplace.new_cart()
+            self.marketplace.publish(producer_id, product)
+            self.marketplace.add_to_cart(cart_id, product)
+            self.marketplace.place_order(cart_id)
+            cart_ids.append(cart_id)
+
+        self.assertEqual(self.marketplace.cart_state(cart_ids[0]), CART_ARCHIVED)
+        self.assertEqual(self.marketplace.cart_state(cart_ids[2]), CART_PLACED)
+        self.assertEqual(self.marketplace.order_history(cart_ids[1]), (self.products[1],),
+                         "Order history NOT kept!")
+
+        for size in (-1, MAX_ORDER_HISTORY_SIZE + 1):
+            with self.assertRaises(ValueError):
+                Marketplace(self.limit, order_history_size=size)
+
+    def test_expire_carts(self):
+        """
+        Tests that an abandoned cart expires and its products are returned to the marketplace.
+        """
+        self.marketplace = Marketplace(self.limit, cart_ttl=0.5)
+        producer_id = self.marketplace.register_producer()
+        for product in self.products[:2]:
+            self.marketplace.publish(producer_id, product)
+        abandoned = self.marketplace.new_cart()
+        active = self.marketplace.new_cart()
+        self.marketplace.add_to_cart(abandoned, self.products[0])
+        self.marketplace.add_to_cart(active, self.products[1])
+
+        now = time.monotonic()
+        self.assertEqual(self.marketplace.expire_carts(now + 0.2), [])
+        self.marketplace.place_order(active)
+        self.assertEqual(self.marketplace.expire_carts(now + 1.0), [abandoned])
+
+        self.assertEqual(self.marketplace.cart_state(abandoned), CART_ARCHIVED)
+        self.assertEqual(list(self.marketplace.queue), [(self.products[0], producer_id)],
+                         "Products NOT returned to the marketplace!")
+        self.assertEqual(self.marketplace.producers[producer_id], 1)
+
+    def test_retry_after(self):
+        """
+        Tests the retry-after hints of try_publish and try_add_to_cart.
+        """
+        self.marketplace = Marketplace(1)
+        producer_id = self.marketplace.register_producer()
+        cart_id = self.marketplace.new_cart()
+
+        result = self.marketplace.try_add_to_cart(cart_id, self.products[0])
+        self.assertFalse(result)
+        self.assertIsNone(result.retry_after, "There is no estimate yet!")
+
+        for _ in range(2):
+            self.assertTrue(self.marketplace.try_publish(producer_id, self.products[0]))
+            self.assertTrue(self.marketplace.try_add_to_cart(cart_id, self.products[0]))
+        self.assertTrue(self.marketplace.try_publish(producer_id, self.products[0]))
+
+        result = self.marketplace.try_publish(producer_id, self.products[0])
+        self.assertFalse(result)
+        self.assertGreaterEqual(result.retry_after, 0.0)
+        self.assertTrue(self.marketplace.try_add_to_cart(cart_id, self.products[0]))
+        self.assertGreaterEqual(
+            self.marketplace.try_add_to_cart(cart_id, self.products[0]).retry_after, 0.0)
+
+    def test_elastic_capacity(self):
+        """
+        Tests that in the elastic mode a producer whose products are missed can publish more
+        than queue_size_per_producer units while another producer is idle.
+        """
+        self.marketplace = Marketplace(self.limit, capacity_mode="elastic")
+        busy = self.marketplace.register_producer()
+        self.marketplace.register_producer()
+        cart_id = self.marketplace.new_cart()
+
+        for _ in range(self.limit):
+            self.assertTrue(self.marketplace.publish(busy, self.products[0]))
+        self.assertFalse(self.marketplace.publish(busy, self.products[0]))
+
+        self.assertFalse(self.marketplace.add_to_cart(cart_id, self.products[1]))
+        self.assertTrue(self.marketplace.publish(busy, self.products[1]),
+                        "The producer of a missed product should get more slots!")
+
+    def test_unknown_options(self):
+        """
+        Tests that a misspelled argument is reported in every capacity mode.
+        """
+        with self.assertRaises(TypeError):
+            Marketplace(self.limit, cart_tll=1.0)
+        with self.assertRaises(TypeError):
+            Marketplace(self.limit, capacity_mode="elastic", order_histroy_size=3)
+
+    def test_add_matching_to_cart(self):
+        """
+        Tests that a query adds the cheapest matching product and keeps the indexes in sync.
+        """
+        producer_id = self.marketplace.register_producer()
+        cart_id = self.marketplace.new_cart()
+        for product in self.products:
+            self.marketplace.publish(producer_id, product)
+
+        query = ProductQuery(product_type="Coffee", roast_level="MEDIUM", min_price=5)
+        self.assertEqual(self.marketplace.add_matching_to_cart(cart_id, query), self.products[2])
+        self.assertEqual(self.marketplace.add_matching_to_cart(cart_id, query), self.products[3])
+        self.assertIsNone(self.marketplace.add_matching_to_cart(cart_id, query))
+
+        self.marketplace.remove_from_cart(cart_id, self.products[3])
+        self.assertEqual(self.marketplace.add_matching_to_cart(cart_id, query), self.products[3])
+        self.assertEqual(self.marketplace.producers[producer_id], 3)
+
+    def test_waitlists(self):
+        """
+        Tests that published and returned units are handed to the waiting carts in FIFO order,
+        without going through the queue or using the producer's slots.
+        """
+        self.marketplace = Marketplace(1, waitlists=True)
+        producer_id = self.marketplace.register_producer()
+        first, second, third = (self.marketplace.new_cart() for _ in range(3))
+
+        self.assertFalse(self.marketplace.add_to_cart(first, self.products[0]))
+        self.assertFalse(self.marketplace.add_to_cart(second, self.products[0]))
+        self.assertFalse(self.marketplace.add_to_cart(first, self.products[0]),
+                         "A cart waits only once for the same product!")
+
+        self.assertTrue(self.marketplace.publish(producer_id, self.products[0]))
+        self.assertTrue(self.marketplace.publish(producer_id, self.products[0]))
+        self.assertEqual(len(self.marketplace.queue), 0)
+        self.assertEqual(self.marketplace.producers[producer_id], 0)
+        self.assertTrue(self.marketplace.add_to_cart(second, self.products[0]))
+        self.assertTrue(self.marketplace.add_to_cart(first, self.products[0]))
+        self.assertFalse(self.marketplace.add_to_cart(first, self.products[0]))
+
+        # the first cart is closed while waiting, so the returned unit skips it
+        self.marketplace.place_order(first)
+        self.assertFalse(self.marketplace.add_to_cart(third, self.products[0]))
+        self.marketplace.remove_from_cart(second, self.products[0])
+        self.assertEqual(self.marketplace.consumers[third], [(self.products[0], producer_id)])
+        self.assertTrue(self.marketplace.publish(producer_id, self.products[0]))
+        self.assertEqual(len(self.marketplace.queue), 1)
+
+    def test_remove_keeps_cart_alive(self):
+        """
+        Tests that a remove_from_cart, as the only activity, restarts the expiry timer.
+        """
+        self.marketplace = Marketplace(self.limit, cart_ttl=0.5)
+        producer_id = self.marketplace.register_producer()
+        cart_id = self.marketplace.new_cart()
+        for product in self.products[:2]:
+            self.marketplace.publish(producer_id, product)
+            self.marketplace.add_to_cart(cart_id, product)
+
+        time.sleep(0.4)
+        self.marketplace.remove_from_cart(cart_id, self.products[0])
+        time.sleep(0.2)
+        self.assertEqual(self.marketplace.expire_carts(), [], "Cart expired too early!")
+        self.assertEqual(self.marketplace.cart_state(cart_id), CART_OPEN)
+
+    def test_cart_expired(self):
+        """
+        Tests that the operations on an expired or placed cart raise CartExpired.
+        """
+        self.marketplace = Marketplace(self.limit, cart_ttl=0.5)
+        expired = self.marketplace.new_cart()
+        placed = self.marketplace.new_cart()
+        self.marketplace.place_order(placed)
+        self.marketplace.expire_carts(time.monotonic() + 1.0)
+
+        with self.assertRaises(CartExpired) as context:
+            self.marketplace.add_to_cart(expired, self.products[0])
+        self.assertEqual(context.exception.state, CART_ARCHIVED)
+        with self.assertRaises(CartExpired):
+            self.marketplace.remove_from_cart(expired, self.products[0])
+        with self.assertRaises(CartExpired):
+            self.marketplace.place_order(placed)
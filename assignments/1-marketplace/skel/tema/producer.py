@@ -15,7 +15,8 @@ class Producer(Thread):
     Class that represents a producer.
     """
 
-    def __init__(self, products, marketplace, republish_wait_time, **kwargs):
+    def __init__(self, products, marketplace, republish_wait_time, scheduler=None, backoff=None,
+                 **kwargs):
         """
         Constructor.
 
@@ -29,6 +30,14 @@ class Producer(Thread):
         @param republish_wait_time: the number of seconds that a producer must
         wait until the marketplace becomes available
 
+        @type scheduler: ProducerScheduler
+        @param scheduler: if set, start() hands the producer to this scheduler instead of
+        running it in its own thread
+
+        @type backoff: AdaptiveBackoff
+        @param backoff: if set, the waits after a rejected publish come from this policy and the
+        marketplace's retry-after hints instead of republish_wait_time
+
         @type kwargs:
         @param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -38,15 +47,51 @@ class Producer(Thread):
         self.marketplace = marketplace
         self.republish_wait_time = republish_wait_time
 
+        self.scheduler = scheduler
+        self.backoff = backoff
+        # the product being published and how many units of it were published
+        self.product_index = 0
+        self.currently_published = 0
+
         self.producer_id = self.marketplace.register_producer()
 
+    def start(self):
+        if self.scheduler is None:
+            Thread.start(self)
+        else:
+            self.scheduler.add(self)
+
+    def step(self):
+        """
+        Tries to publish the next unit.
+
+        :returns the number of seconds to wait before the next step
+        """
+        product, quantity, wait_time = self.products[self.product_index]
+        if self.currently_published >= quantity:
+            self._next_product()
+            return 0
+
+        if self.backoff is None:
+            published = self.marketplace.publish(self.producer_id, product)
+        else:
+            published = self.marketplace.try_publish(self.producer_id, product)
+
+        if published:
+            self.currently_published += 1
+            if self.currently_published == quantity:
+                self._next_product()
+            if self.backoff is not None:
+                self.backoff.reset()
+            return wait_time
+        if self.backoff is not None:
+            return self.backoff.next_delay(published.retry_after)
+        return self.republish_wait_time
+
+    def _next_product(self):
+        self.product_index = (self.product_index + 1) % len(self.products)
+        self.currently_published = 0
+
     def run(self):
         while True:
-            for (product, quantity, wait_time) in self.products:
-                currently_published = 0
-                while currently_published < quantity:
-                    if self.marketplace.publish(self.producer_id, product):
-                        currently_published += 1
-                        sleep(wait_time)
-                    else:
-                        sleep(self.republish_wait_time)
+            sleep(self.step())
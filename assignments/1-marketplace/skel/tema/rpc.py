@@ -0,0 +1,488 @@
+"""
+This module exposes a Marketplace over a local socket and offers the client used to access it
+from other processes.
+
+Every message is a frame: a 4 byte big-endian length followed by a pickled payload. A request
+frame holds a batch of calls, a list of (method, args) tuples, and its response frame holds
+one (ok, value) tuple for each call, in the same order. Only the Product classes and OpResult
+may be unpickled, so a peer cannot make the other side build arbitrary objects.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import io
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import unittest
+from json import loads
+from queue import Empty, Queue
+from threading import Lock, Thread, current_thread
+
+from .capacity import CAPACITY_ELASTIC, CAPACITY_FIXED
+from .inventory import ProductQuery
+from .marketplace import CartExpired, Marketplace, OpResult
+from .product import Product, Coffee, Tea
+
+HEADER = struct.Struct("!I")
+
+# the Marketplace methods that can be called remotely; place_order is served by checkout,
+# the client prints the bought products itself, in the consumer's thread
+EXPORTED_METHODS = {
+    "register_producer": "register_producer",
+    "publish": "publish",
+    "try_publish": "try_publish",
+    "new_cart": "new_cart",
+    "add_to_cart": "add_to_cart",
+    "try_add_to_cart": "try_add_to_cart",
+    "add_matching_to_cart": "add_matching_to_cart",
+    "remove_from_cart": "remove_from_cart",
+    "place_order": "checkout",
+    "cart_state": "cart_state",
+    "order_history": "order_history",
+}
+
+ALLOWED_CLASSES = {(cls.__module__, cls.__name__): cls
+                   for cls in (Product, Coffee, Tea, OpResult, ProductQuery, CartExpired)}
+
+
+class RemoteError(Exception):
+    """
+    Raised by the client when a call failed on the server.
+    """
+
+
+class _ProductUnpickler(pickle.Unpickler):
+    """
+    Unpickler that only resolves the Product classes, OpResult, ProductQuery and CartExpired.
+    """
+
+    def find_class(self, module, name):
+        if (module, name) in ALLOWED_CLASSES:
+            return ALLOWED_CLASSES[module, name]
+        raise pickle.UnpicklingError(f"{module}.{name} is not allowed")
+
+
+def encode_frame(payload):
+    """
+    Serializes a payload into a frame.
+    """
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(data)) + data
+
+
+def read_frame(rfile):
+    """
+    Reads a frame from a binary file-like object.
+
+    :returns the payload, or None if the peer closed the connection
+    """
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    data = rfile.read(length)
+    if len(data) < length:
+        return None
+    return _ProductUnpickler(io.BytesIO(data)).load()
+
+
+def parse_address(address):
+    """
+    Turns "host:port" into a TCP address and anything else into a Unix socket path.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+class _MarketplaceHandler(socketserver.StreamRequestHandler):
+    """
+    Serves the requests of a single connection until the client closes it.
+    """
+
+    def handle(self):
+        marketplace = self.server.marketplace
+        while True:
+            batch = read_frame(self.rfile)
+            if batch is None:
+                return
+
+            results = []
+            for method, args in batch:
+                try:
+                    results.append((True, getattr(marketplace, EXPORTED_METHODS[method])(*args)))
+                except CartExpired as error:
+                    # part of the API, raised again by the client
+                    results.append((False, error))
+                except Exception as error:  # pylint: disable=broad-except
+                    results.append((False, f"{type(error).__name__}: {error}"))
+            self.wfile.write(encode_frame(results))
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MarketplaceServer:
+    """
+    Class that serves a Marketplace over a TCP or a Unix socket. Each connection gets its own
+    thread, so the marketplace is used concurrently just like by local producers and consumers.
+    """
+
+    def __init__(self, marketplace, address):
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace to serve
+
+        :type address: Tuple or String
+        :param address: a (host, port) tuple for TCP or a path for a Unix socket
+        """
+        if isinstance(address, tuple):
+            self.server = _TCPServer(address, _MarketplaceHandler)
+            self.server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = _UnixServer(address, _MarketplaceHandler)
+        self.server.marketplace = marketplace
+        self.address = self.server.server_address
+
+    def serve_forever(self):
+        """
+        Serves requests until shutdown() is called.
+        """
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serves requests from a daemon thread.
+        """
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        """
+        Stops the server and closes its socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class _Connection:
+    """
+    A client connection to a MarketplaceServer.
+    """
+
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.rfile = self.sock.makefile("rb")
+
+    def exchange(self, batches):
+        """
+        Sends all the batches before reading any response, then returns the responses.
+        """
+        self.sock.sendall(b"".join(encode_frame(batch) for batch in batches))
+        responses = []
+        for _ in batches:
+            response = read_frame(self.rfile)
+            if response is None:
+                raise ConnectionError("the marketplace server closed the connection")
+            responses.append(response)
+        return responses
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.rfile.close()
+        self.sock.close()
+
+
+class Pipeline:
+    """
+    Collects calls and sends them to the server in as few round trips as possible. The calls
+    are split into batches of at most batch_size calls, all sent back to back.
+    """
+
+    def __init__(self, client, batch_size):
+        self.client = client
+        self.batch_size = batch_size
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.calls = []
+
+    def __getattr__(self, method):
+        if method not in EXPORTED_METHODS:
+            raise AttributeError(method)
+        return lambda *args: self.calls.append((method, args))
+
+    def execute(self):
+        """
+        Sends the collected calls.
+
+        :returns a list with the result of each call
+        """
+        calls, self.calls = self.calls, []
+        batches = [calls[i:i + self.batch_size] for i in range(0, len(calls), self.batch_size)]
+        return [value
+                for response in self.client.exchange(batches)
+                for value in MarketplaceClient.unwrap(response)]
+
+
+class MarketplaceClient:
+    """
+    Class that offers the Marketplace API of a remote marketplace, so it can be given to
+    Producers and Consumers instead of a local Marketplace. It is thread-safe: each call
+    borrows a connection from a pool.
+    """
+
+    def __init__(self, address, pool_size=8, batch_size=256):
+        """
+        Constructor
+
+        :type address: Tuple or String
+        :param address: a (host, port) tuple for TCP or a path for a Unix socket
+
+        :type pool_size: Int
+        :param pool_size: the number of idle connections kept open
+
+        :type batch_size: Int
+        :param batch_size: the maximum number of calls sent in a frame by a pipeline
+        """
+        self.address = address
+        self.batch_size = batch_size
+        self.pool = Queue(maxsize=pool_size)
+        self.print_mutex = Lock()
+
+    def exchange(self, batches):
+        """
+        Sends the batches on a pooled connection and returns the responses.
+        """
+        try:
+            connection = self.pool.get_nowait()
+        except Empty:
+            connection = _Connection(self.address)
+
+        try:
+            responses = connection.exchange(batches)
+        except Exception:
+            connection.close()
+            raise
+
+        if self.pool.full():
+            connection.close()
+        else:
+            self.pool.put(connection)
+        return responses
+
+    @staticmethod
+    def unwrap(response):
+        """
+        Turns a response into the list of results, raising RemoteError on a failed call or
+        CartExpired when the marketplace raised it.
+        """
+        results = []
+        for success, value in response:
+            if isinstance(value, CartExpired):
+                raise value
+            if not success:
+                raise RemoteError(value)
+            results.append(value)
+        return results
+
+    def call(self, method, *args):
+        """
+        Calls a marketplace method remotely and returns its result.
+        """
+        return self.unwrap(self.exchange([[(method, args)]])[0])[0]
+
+    def pipeline(self):
+        """
+        Returns a Pipeline that batches the calls made on it until execute() is called.
+        """
+        return Pipeline(self, self.batch_size)
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+    def register_producer(self):
+        """
+        See Marketplace.register_producer.
+        """
+        return self.call("register_producer")
+
+    def publish(self, producer_id, product):
+        """
+        See Marketplace.publish.
+        """
+        return self.call("publish", producer_id, product)
+
+    def try_publish(self, producer_id, product):
+        """
+        See Marketplace.try_publish.
+        """
+        return self.call("try_publish", producer_id, product)
+
+    def new_cart(self):
+        """
+        See Marketplace.new_cart.
+        """
+        return self.call("new_cart")
+
+    def add_to_cart(self, cart_id, product):
+        """
+        See Marketplace.add_to_cart.
+        """
+        return self.call("add_to_cart", cart_id, product)
+
+    def try_add_to_cart(self, cart_id, product):
+        """
+        See Marketplace.try_add_to_cart.
+        """
+        return self.call("try_add_to_cart", cart_id, product)
+
+    def add_matching_to_cart(self, cart_id, query):
+        """
+        See Marketplace.add_matching_to_cart.
+        """
+        return self.call("add_matching_to_cart", cart_id, query)
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        See Marketplace.remove_from_cart.
+        """
+        return self.call("remove_from_cart", cart_id, product)
+
+    def place_order(self, cart_id):
+        """
+        See Marketplace.place_order. The products are printed by the calling thread.
+        """
+        cart = self.call("place_order", cart_id)
+        for product in cart:
+            with self.print_mutex:
+                print(f"{current_thread().name} bought {product[0]}")
+        return cart
+
+
+def main():
+    """
+    Serves a marketplace until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Serves a Marketplace over a local socket.")
+    parser.add_argument("address", help="host:port for TCP, otherwise a Unix socket path")
+    parser.add_argument("--config", help="a test file; its marketplace section is used, the "
+                                          "options below override it")
+    parser.add_argument("--queue-size-per-producer", type=int, help="8 without --config")
+    parser.add_argument("--order-history-size", type=int)
+    parser.add_argument("--cart-ttl", type=float)
+    parser.add_argument("--capacity-mode", choices=(CAPACITY_FIXED, CAPACITY_ELASTIC),
+                        default=CAPACITY_FIXED)
+    parser.add_argument("--waitlists", action="store_true")
+    args = parser.parse_args()
+
+    options = {"queue_size_per_producer": 8}
+    if args.config:
+        with open(args.config, encoding="utf-8") as input_file:
+            options = loads(input_file.read())["marketplace"]
+    for option in ("queue_size_per_producer", "order_history_size", "cart_ttl"):
+        if getattr(args, option) is not None:
+            options[option] = getattr(args, option)
+    marketplace = Marketplace(**options, capacity_mode=args.capacity_mode,
+                              waitlists=args.waitlists)
+
+    server = MarketplaceServer(marketplace, parse_address(args.address))
+    print(f"serving on {server.address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+class TestMarketplaceRPC(unittest.TestCase):
+    """
+    Class used for testing the remote marketplace.
+    """
+    def setUp(self):
+        """
+        Serve a marketplace on an ephemeral TCP port.
+        """
+        self.marketplace = Marketplace(5)
+        self.server = MarketplaceServer(self.marketplace, ("127.0.0.1", 0))
+        self.server.start()
+        self.client = MarketplaceClient(self.server.address)
+        self.product = Tea("Linden", 9, "Herbal")
+
+    def tearDown(self):
+        """
+        Close the client and the server.
+        """
+        self.client.close()
+        self.server.shutdown()
+
+    def test_calls(self):
+        """
+        Tests the Marketplace API through the client.
+        """
+        producer_id = self.client.register_producer()
+        cart_id = self.client.new_cart()
+        self.assertTrue(self.client.publish(producer_id, self.product))
+        self.assertTrue(self.client.add_to_cart(cart_id, self.product))
+        self.assertFalse(self.client.try_add_to_cart(cart_id, self.product))
+        self.assertIsNone(self.client.add_matching_to_cart(cart_id, ProductQuery(max_price=1)))
+        self.assertEqual(self.client.call("place_order", cart_id), [(self.product, producer_id)])
+        self.assertEqual(list(self.marketplace.queue), [])
+
+    def test_pipeline(self):
+        """
+        Tests that pipelined calls return their results in order, across several frames.
+        """
+        producer_id = self.client.register_producer()
+        with self.client.pipeline() as pipeline:
+            pipeline.batch_size = 2
+            for _ in range(6):
+                pipeline.publish(producer_id, self.product)
+            results = pipeline.execute()
+        self.assertEqual(results, [True] * 5 + [False])
+
+    def test_remote_error(self):
+        """
+        Tests that a failed call raises RemoteError and a closed cart CartExpired.
+        """
+        with self.assertRaises(RemoteError):
+            self.client.publish("unknown producer", self.product)
+        with self.assertRaises(CartExpired):
+            self.client.add_to_cart(-1, self.product)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+This module represents the ProducerScheduler.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import heapq
+import itertools
+import time
+import unittest
+from threading import Condition, Thread
+
+from .marketplace import Marketplace
+from .producer import Producer
+from .product import Coffee, Tea
+
+
+class ProducerScheduler:
+    """
+    Class that drives many producers from a few threads. The producers wait in a heap ordered
+    by the time of their next step, so a worker only wakes up when a producer is due; each
+    producer keeps the timing it would have in its own thread, because its next step is
+    scheduled when the current one ends.
+    """
+
+    def __init__(self, workers=1):
+        """
+        Constructor
+
+        :type workers: Int
+        :param workers: the number of threads that run the producers' steps
+        """
+        self.workers = workers
+        self.heap = []
+        # breaks the ties between producers due at the same time
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        # created here so they can be wrapped (e.g. profiled) before they run the producers
+        self.threads = [Thread(target=self._work, name=f"ProducerScheduler-{i}", daemon=True)
+                        for i in range(workers)]
+        self.started = False
+        self.stopped = False
+
+    def add(self, producer):
+        """
+        Schedules the first step of a producer right away. The worker threads are started by
+        the first call.
+        """
+        self._push(time.monotonic(), producer)
+        if not self.started:
+            self.started = True
+            for thread in self.threads:
+                thread.start()
+
+    def _push(self, due, producer):
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.sequence), producer))
+            # only a worker that sleeps past the new due time must wake up early
+            if self.heap[0][2] is producer:
+                self.condition.notify()
+
+    def _pop_due(self):
+        """
+        Waits for the next producer that is due and takes it out of the heap.
+
+        :returns the producer or None if the scheduler was stopped
+        """
+        with self.condition:
+            while not self.stopped:
+                if self.heap:
+                    delay = self.heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        return heapq.heappop(self.heap)[2]
+                    self.condition.wait(delay)
+                else:
+                    self.condition.wait()
+            return None
+
+    def _work(self):
+        while True:
+            producer = self._pop_due()
+            if producer is None:
+                return
+            # a producer is never in the heap while it runs, so it never runs concurrently
+            delay = producer.step()
+            self._push(time.monotonic() + delay, producer)
+
+    def stop(self):
+        """
+        Stops the worker threads.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.started:
+            for thread in self.threads:
+                thread.join()
+
+
+class TestProducerScheduler(unittest.TestCase):
+    """
+    Class used for testing the producer scheduler.
+    """
+    def test_publish_order(self):
+        """
+        Tests that scheduled producers publish like producer threads, up to their limit.
+        """
+        marketplace = Marketplace(3)
+        scheduler = ProducerScheduler(2)
+        tea = Tea("Linden", 9, "Herbal")
+        coffee = Coffee("Indonezia", 1, 5.05, "MEDIUM")
+        producers = [Producer([(tea, 2, 0.01), (coffee, 1, 0.01)], marketplace, 0.01,
+                              scheduler=scheduler) for _ in range(10)]
+        for producer in producers:
+            producer.start()
+        time.sleep(0.3)
+        scheduler.stop()
+
+        self.assertEqual(len(scheduler.threads), 2)
+        for producer in producers:
+            self.assertEqual([product for product, producer_id in marketplace.queue
+                              if producer_id == producer.producer_id], [tea, tea, coffee])
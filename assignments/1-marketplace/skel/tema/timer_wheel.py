@@ -0,0 +1,183 @@
+"""
+This module represents the TimerWheel used to expire carts.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+import math
+import time
+import unittest
+
+# the largest wheel built by for_timeout; longer timeouts wait for extra rounds
+MAX_SLOTS = 1024
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel. Timers are kept in a ring of slots, one slot per tick; scheduling,
+    cancelling and advancing by one tick are constant time operations, apart from the timers
+    that actually expire. A timer longer than the wheel waits for a number of extra rounds,
+    and a long advance skips the whole revolutions in a single pass over the timers.
+    """
+
+    def __init__(self, tick, slots, now=0.0):
+        """
+        Constructor
+
+        :type tick: Float
+        :param tick: the duration of a tick, in seconds
+
+        :type slots: Int
+        :param slots: the number of slots of the wheel
+
+        :type now: Float
+        :param now: the current time, in seconds
+        """
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        # key -> the slot it is waiting in
+        self.location = {}
+        self.cursor = 0
+        self.start = now
+        self.ticks = 0
+
+    @classmethod
+    def for_timeout(cls, timeout, tick, now=0.0):
+        """
+        Builds a wheel for timers of at most timeout seconds: large enough for them to never
+        need extra rounds, but with at most MAX_SLOTS slots.
+        """
+        return cls(tick, min(math.ceil(timeout / tick) + 1, MAX_SLOTS), now)
+
+    def __len__(self):
+        return len(self.location)
+
+    def __contains__(self, key):
+        return key in self.location
+
+    def schedule(self, key, delay):
+        """
+        Schedules (or reschedules) the timer identified by key to expire after delay seconds.
+        """
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot][key] = (ticks - 1) // len(self.slots)
+        self.location[key] = slot
+
+    def cancel(self, key):
+        """
+        Cancels the timer identified by key, if it is scheduled.
+        """
+        slot = self.location.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now):
+        """
+        Moves the wheel up to the given time.
+
+        :returns a list with the keys of the expired timers
+        """
+        # the epsilon keeps float division from losing a tick that ends exactly at now
+        elapsed = int((now - self.start) / self.tick + 1e-9) - self.ticks
+        if elapsed <= 0:
+            return []
+        self.ticks += elapsed
+
+        if not self.location:
+            self.cursor = (self.cursor + elapsed) % len(self.slots)
+            return []
+
+        expired = []
+        revolutions, elapsed = divmod(elapsed, len(self.slots))
+        if revolutions:
+            # every slot is visited revolutions times and the cursor ends where it started
+            for index, slot in enumerate(self.slots):
+                waiting = {}
+                for key, rounds in slot.items():
+                    if rounds >= revolutions:
+                        waiting[key] = rounds - revolutions
+                    else:
+                        del self.location[key]
+                        expired.append(key)
+                self.slots[index] = waiting
+
+        for done in range(1, elapsed + 1):
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            slot = self.slots[self.cursor]
+            if not slot:
+                continue
+            waiting = {key: rounds - 1 for key, rounds in slot.items() if rounds > 0}
+            for key in slot:
+                if key not in waiting:
+                    del self.location[key]
+                    expired.append(key)
+            self.slots[self.cursor] = waiting
+            if not self.location:
+                # nothing left to expire, skip the remaining ticks
+                self.cursor = (self.cursor + elapsed - done) % len(self.slots)
+                break
+        return expired
+
+
+class TestTimerWheel(unittest.TestCase):
+    """
+    Class used for testing the timer wheel.
+    """
+    def setUp(self):
+        """
+        Initialize a wheel with 0.1s ticks.
+        """
+        self.wheel = TimerWheel(0.1, 8)
+
+    def test_expire(self):
+        """
+        Tests that timers expire after their delay and not before.
+        """
+        self.wheel.schedule("a", 0.25)
+        self.wheel.schedule("b", 0.5)
+        self.assertEqual(self.wheel.advance(0.2), [])
+        self.assertEqual(self.wheel.advance(0.3), ["a"])
+        self.assertEqual(self.wheel.advance(1.0), ["b"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel_and_reschedule(self):
+        """
+        Tests that cancelled timers never expire and rescheduled ones use the new delay.
+        """
+        self.wheel.schedule("a", 0.2)
+        self.wheel.schedule("b", 0.2)
+        self.wheel.cancel("a")
+        self.wheel.advance(0.1)
+        self.wheel.schedule("b", 0.3)
+        self.assertEqual(self.wheel.advance(0.3), [])
+        self.assertEqual(self.wheel.advance(0.4), ["b"])
+
+    def test_extra_rounds(self):
+        """
+        Tests timers longer than the wheel.
+        """
+        self.wheel.schedule("a", 2.0)
+        self.assertEqual(self.wheel.advance(1.9), [])
+        self.assertEqual(self.wheel.advance(2.0), ["a"])
+
+    def test_long_timeout(self):
+        """
+        Tests that a day long timeout keeps the wheel small and that a long advance skips the
+        whole revolutions instead of stepping through every tick.
+        """
+        wheel = TimerWheel.for_timeout(86400, 0.1)
+        self.assertEqual(len(wheel.slots), MAX_SLOTS)
+        wheel.schedule("a", 86400)
+        wheel.schedule("b", 3600)
+        wheel.schedule("c", 60)
+        self.assertEqual(wheel.advance(59.9), [])
+        self.assertEqual(wheel.advance(60.0), ["c"])
+
+        start = time.perf_counter()
+        self.assertEqual(wheel.advance(86399.9), ["b"])
+        self.assertLess(time.perf_counter() - start, 0.1, "The advance should skip revolutions!")
+        self.assertEqual(wheel.advance(86400.0), ["a"])
+        self.assertEqual(len(wheel), 0)
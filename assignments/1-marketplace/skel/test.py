@@ -6,13 +6,90 @@ Assignment 1
 March 2020
 """
 
+import argparse
 import sys
 from json import loads
 
+from profiler import StackSampler, ThreadProfiler
+
 from tema.producer import Producer
 from tema.consumer import Consumer
 from tema.marketplace import Marketplace
 from tema.product import Product, Coffee, Tea
+from tema.backoff import AdaptiveBackoff
+from tema.rpc import MarketplaceClient, parse_address
+from tema.scheduler import ProducerScheduler
+
+
+def parse_args():
+    """
+        Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="the test input file")
+    # the remote marketplace is configured by its server, see tema/rpc.py --waitlists
+    engine = parser.add_mutually_exclusive_group()
+    engine.add_argument("--connect", metavar="ADDRESS",
+                        help="use the marketplace served at ADDRESS (host:port or a Unix "
+                             "socket path, see tema/rpc.py) instead of a local one")
+    parser.add_argument("--plan", action="store_true",
+                        help="consumers only execute the net effect of each cart")
+    parser.add_argument("--scheduler-threads", metavar="N", type=int,
+                        help="drive all the producers from N scheduler threads instead of "
+                             "one thread per producer")
+    parser.add_argument("--backoff", action="store_true",
+                        help="producers and consumers retry with an adaptive backoff driven "
+                             "by the marketplace's retry-after hints")
+    engine.add_argument("--waitlists", action="store_true",
+                        help="carts wait for the missing products in FIFO waitlists and get "
+                             "the next units directly (local marketplace only)")
+    profiling = parser.add_mutually_exclusive_group()
+    profiling.add_argument("--profile", action="store_true",
+                           help="profile every producer and consumer thread with cProfile and "
+                                "print the merged report to stderr")
+    profiling.add_argument("--sample", metavar="INTERVAL", type=float,
+                           help="sample the stacks of all threads every INTERVAL seconds and "
+                                "print the hottest frames to stderr")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="with --profile, dump the merged stats (pstats format); with "
+                             "--sample, write the collapsed stacks for flamegraph tools")
+    return parser.parse_args()
+
+
+def make_backoff(args, wait_time):
+    """
+        Build the backoff policy of a producer or consumer, if requested
+    """
+    return AdaptiveBackoff(wait_time) if args.backoff else None
+
+
+def start_profiling(args, threads):
+    """
+        Start the profiler or the sampler requested on the command line, if any
+    """
+    if args.profile:
+        profiler = ThreadProfiler()
+        for thread in threads:
+            profiler.wrap(thread)
+        return profiler
+    if args.sample:
+        sampler = StackSampler(args.sample)
+        sampler.start()
+        return sampler
+    return None
+
+
+def stop_profiling(args, profiler):
+    """
+        Write the profiling report to stderr, stdout holds the bought products
+    """
+    if isinstance(profiler, StackSampler):
+        profiler.stop()
+        profiler.report(sys.stderr)
+        if args.profile_output:
+            profiler.write_collapsed(args.profile_output)
+    else:
+        profiler.report(sys.stderr, args.profile_output)
 
 
 def main():
@@ -20,13 +97,9 @@ def main():
         Convert the market_configuration input file into specific models:
         Producer, Consumer, Marketplace
     """
-    try:
-        filename = sys.argv[1]
-    except IndexError:
-        print("no input file specified")
-        raise SystemExit
+    args = parse_args()
 
-    with open(filename) as input_file:
+    with open(args.filename) as input_file:
         market_config = loads(input_file.read())
 
     # turn product definitions into actual products
@@ -49,26 +122,38 @@ def main():
             for operation in cart:
                 operation['product'] = products[operation['product']]
 
-    # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
-
-    # build and start the producers
-    producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
+    # build the marketplace or connect to a remote one
+    if args.connect:
+        marketplace = MarketplaceClient(parse_address(args.connect))
+    else:
+        marketplace = Marketplace(**market_config['marketplace'], waitlists=args.waitlists)
+
+    # build the producers and the consumers
+    scheduler = ProducerScheduler(args.scheduler_threads) if args.scheduler_threads else None
+    producers = [Producer(**p_market_config, marketplace=marketplace, scheduler=scheduler,
+                          backoff=make_backoff(args, p_market_config['republish_wait_time']),
+                          daemon=True)
                  for p_market_config in market_config['producers']]
+    consumers = [Consumer(**c_market_config, marketplace=marketplace, plan_carts=args.plan,
+                          backoff=make_backoff(args, c_market_config['retry_wait_time']))
+                 for c_market_config in market_config['consumers']]
 
+    # the scheduled producers run in the scheduler's threads, not in their own
+    profiler = start_profiling(args, (scheduler.threads if scheduler else producers) + consumers)
+
+    # start them
     for producer in producers:
         producer.start()
 
-    # build and start the consumers
-    consumers = [Consumer(**c_market_config, marketplace=marketplace)
-                 for c_market_config in market_config['consumers']]
-
     for consumer in consumers:
         consumer.start()
 
     for consumer in consumers:
         consumer.join()
 
+    if profiler:
+        stop_profiling(args, profiler)
+
 
 if __name__ == '__main__':
     main()